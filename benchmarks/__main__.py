@@ -0,0 +1,72 @@
+"""
+Runs benchmarks and writes seconds per call of every case as JSON. Given
+a baseline of an earlier run, it reports cases which got slower than the
+tolerance and exits with 1 if any did.
+
+	python -m benchmarks --output baseline.json
+	python -m benchmarks --compare baseline.json --tolerance 0.2
+	python -m benchmarks serializers filters
+"""
+import sys
+import json
+import argparse
+import importlib
+
+BENCHMARKS = ["dependency", "compose", "serializers", "permissions", "filters"]
+
+def run(names):
+	results = {}
+	for name in names:
+		module = importlib.import_module("benchmarks.bench_{}".format(name))
+		results.update(module.run())
+	return results
+
+def compare(results, baseline, tolerance):
+	"""
+	Returns [name, baseline seconds, seconds] of cases which regressed.
+	"""
+	regressions = []
+	for name, seconds in sorted(results.items()):
+		base = baseline.get(name)
+		if base and seconds > base * (1 + tolerance):
+			regressions.append([name, base, seconds])
+	return regressions
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m benchmarks")
+	parser.add_argument("names", nargs="*", help="Any of {}.".format(", ".join(BENCHMARKS)))
+	parser.add_argument("--output", help="Writes results to the file.")
+	parser.add_argument("--compare", help="Compares results with the baseline file.")
+	parser.add_argument \
+			( "--tolerance"
+			, type=float
+			, default=0.2
+			, help="Slowdown which is not a regression, e.g. 0.2 for 20%%."
+			)
+	args = parser.parse_args(argv)
+	unknown = sorted(set(args.names) - set(BENCHMARKS))
+	if unknown:
+		parser.error("unknown benchmarks: {}".format(", ".join(unknown)))
+
+	results = run(args.names or BENCHMARKS)
+	output = json.dumps(results, indent=2, sort_keys=True)
+	if args.output:
+		with open(args.output, "w") as f:
+			f.write(output + "\n")
+	else:
+		print(output)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		regressions = compare(results, baseline, args.tolerance)
+		for name, base, seconds in regressions:
+			sys.stderr.write("{:<40} {:>12.6f} ms -> {:>12.6f} ms ({:+.0%})\n".format \
+					(name, base * 1000, seconds * 1000, seconds / base - 1))
+		if regressions:
+			sys.stderr.write("{} of {} cases regressed.\n".format(len(regressions), len(results)))
+			return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
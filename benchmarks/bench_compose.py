@@ -0,0 +1,53 @@
+"""
+Benchmarks filling templates and making requests of compose payloads.
+
+	python -m benchmarks.bench_compose
+"""
+from benchmarks.utils import setup_django, measure
+
+setup_django()
+
+from sane_api.helpers import compile_template, fill_template, make_requests
+from benchmarks.bench_dependency import make_chain, make_wide
+
+SIZES = [10, 100, 1000]
+DEPTHS = [1, 4, 16]
+
+class EchoDispatcher:
+	def get(self, url, query):
+		return {"id": 1, "query": query}
+
+def make_template(width, depth):
+	path = ".".join(["user"] + ["child"] * (depth - 1) + ["id"])
+	query = dict(("p{}".format(i), "{" + path + "}") for i in range(width))
+	return {"url": "/article/", "query": query}
+
+def make_responses(depth):
+	node = {"id": 1}
+	for _ in range(depth - 1):
+		node = {"child": node, "id": 1}
+	return {"user": node}
+
+def run():
+	results = {}
+	for width in SIZES:
+		for depth in DEPTHS:
+			template = make_template(width, depth)
+			compiled = compile_template(template)
+			responses = make_responses(depth)
+			results["compose.fill.{}.{}".format(width, depth)] = \
+					measure(lambda: fill_template(template, responses))
+			results["compose.fill_compiled.{}.{}".format(width, depth)] = \
+					measure(lambda: compiled.fill(responses))
+
+	dispatcher = EchoDispatcher()
+	for name, make_payload in [("chain", make_chain), ("wide", make_wide)]:
+		for size in SIZES:
+			req_sigs = list(make_payload(size).items())
+			results["compose.requests.{}.{}".format(name, size)] = \
+					measure(lambda: make_requests(dispatcher, req_sigs))
+	return results
+
+if __name__ == "__main__":
+	for name, seconds in sorted(run().items()):
+		print("{:<32} {:>12.6f} ms".format(name, seconds * 1000))
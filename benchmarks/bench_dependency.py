@@ -0,0 +1,80 @@
+"""
+Benchmarks dependency checks of compose payloads.
+
+	python -m benchmarks.bench_dependency
+"""
+import random
+
+from benchmarks.utils import setup_django, measure
+
+setup_django()
+
+from sane_api.helpers import \
+		( get_dependency_graph
+		, get_cyclic_dependencies
+		, get_unmet_dependencies
+		)
+
+SIZES = [10, 100, 1000, 10000]
+
+def make_chain(size):
+	payload = {"key0": {"url": "/key/"}}
+	for i in range(1, size):
+		payload["key{}".format(i)] = \
+				{ "url": "/key/"
+				, "query": {"parent": "{{key{}.id}}".format(i - 1)}
+				}
+	return payload
+
+def make_wide(size):
+	payload = {"root": {"url": "/root/"}}
+	for i in range(1, size):
+		payload["key{}".format(i)] = \
+				{ "url": "/key/"
+				, "query": {"root": "{root.id}"}
+				}
+	return payload
+
+def make_random(size, seed=0):
+	rand = random.Random(seed)
+	payload = {}
+	for i in range(size):
+		parents = rand.sample(range(i), min(i, 3))
+		payload["key{}".format(i)] = \
+				{ "url": "/key/"
+				, "query": dict \
+						( ("p{}".format(parent), "{{key{}.id}}".format(parent))
+						for parent in parents
+						)
+				}
+	return payload
+
+def make_cyclic(size):
+	payload = make_chain(size)
+	payload["key0"]["query"] = {"parent": "{{key{}.id}}".format(size - 1)}
+	return payload
+
+PAYLOADS = \
+		[ ("chain", make_chain)
+		, ("wide", make_wide)
+		, ("random", make_random)
+		, ("cyclic", make_cyclic)
+		]
+
+def check(payload):
+	graph = get_dependency_graph(payload)
+	get_cyclic_dependencies(payload, graph)
+	get_unmet_dependencies(payload, graph)
+
+def run():
+	results = {}
+	for name, make_payload in PAYLOADS:
+		for size in SIZES:
+			payload = make_payload(size)
+			results["dependency.{}.{}".format(name, size)] = \
+					measure(lambda: check(payload))
+	return results
+
+if __name__ == "__main__":
+	for name, seconds in sorted(run().items()):
+		print("{:<32} {:>12.6f} ms".format(name, seconds * 1000))
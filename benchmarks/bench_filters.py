@@ -0,0 +1,42 @@
+"""
+Benchmarks instantiation of SaneFilterSet with cold and warm cache of
+generated filters.
+
+	python -m benchmarks.bench_filters
+"""
+from benchmarks.utils import setup_django, measure
+
+setup_django()
+
+from sane_api.filters import SaneFilterSet
+from tests.models import Article
+
+class ArticleFilterSet(SaneFilterSet):
+	def get_filterables(self):
+		return \
+				{ "id": ["exact", "in"]
+				, "title": ["exact", "istartswith", "iendswith"]
+				, "body": ["icontains"]
+				, "user": ["exact", "in"]
+				}
+
+	class Meta:
+		model = Article
+		fields = "__all__"
+
+def instantiate_cold():
+	SaneFilterSet.filters_cache.clear()
+	return ArticleFilterSet({"title": "a"})
+
+def instantiate_warm():
+	return ArticleFilterSet({"title": "a"})
+
+def run():
+	return \
+			{ "filterset.cold": measure(instantiate_cold)
+			, "filterset.warm": measure(instantiate_warm)
+			}
+
+if __name__ == "__main__":
+	for name, seconds in sorted(run().items()):
+		print("{:<32} {:>12.6f} ms".format(name, seconds * 1000))
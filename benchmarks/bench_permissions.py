@@ -0,0 +1,47 @@
+"""
+Benchmarks api and object level checks of SanePermissionClass.
+
+	python -m benchmarks.bench_permissions
+"""
+from benchmarks.utils import setup_django, measure
+
+setup_django()
+
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from sane_api.apis import SaneAPI, SanePermissionClass
+from tests.models import Comment
+
+factory = APIRequestFactory()
+
+class CommentAPI(SaneAPI):
+	def can_retrieve(self, user, request):
+		return True
+
+def make_view(action):
+	view = CommentAPI()
+	view.action = action
+	return view
+
+def run():
+	permission = SanePermissionClass()
+	request = Request(factory.get("/"))
+	request.user = AnonymousUser()
+	comment = Comment(pk=1, content="comment")
+	allowed, absent = make_view("retrieve"), make_view("destroy")
+	return \
+			{ "permission.api.allowed": \
+					measure(lambda: permission.has_permission(request, allowed))
+			, "permission.api.absent": \
+					measure(lambda: permission.has_permission(request, absent))
+			, "permission.object.allowed": \
+					measure(lambda: permission.has_object_permission(request, allowed, comment))
+			, "permission.object.absent": \
+					measure(lambda: permission.has_object_permission(request, absent, comment))
+			}
+
+if __name__ == "__main__":
+	for name, seconds in sorted(run().items()):
+		print("{:<32} {:>12.6f} us".format(name, seconds * 1000000))
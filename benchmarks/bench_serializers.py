@@ -0,0 +1,102 @@
+"""
+Benchmarks per row cost of SaneModelSerializer against DRF's
+ModelSerializer, of its permission field, and of lists read from the
+database as objects or as rows of values.
+
+	python -m benchmarks.bench_serializers
+"""
+from benchmarks.utils import setup_django, measure
+
+setup_django()
+
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from sane_api.serializers import SaneModelSerializer
+from tests.models import CModel, Comment
+
+SIZES = [10, 100, 1000, 10000]
+
+factory = APIRequestFactory()
+
+class PlainSerializer(serializers.ModelSerializer):
+	class Meta:
+		model = CModel
+		fields = ("id", "name")
+
+class SaneSerializer(SaneModelSerializer):
+	def get_readable_fields(self):
+		return ["id", "name"]
+
+	def get_writable_fields(self):
+		return ["name"]
+
+	class Meta:
+		model = CModel
+		fields = ("id", "name")
+
+class CachedSaneSerializer(SaneSerializer):
+	def get_access_profile_key(self):
+		return "all"
+
+class PermissionSerializer(SaneModelSerializer):
+	def get_readable_fields(self):
+		return ["id", "content", "permissions"]
+
+	def get_writable_fields(self):
+		return ["content"]
+
+	class Meta:
+		model = Comment
+		fields = ("id", "content", "permissions")
+
+SERIALIZERS = \
+		[ ("plain", PlainSerializer)
+		, ("sane", SaneSerializer)
+		, ("sane_cached", CachedSaneSerializer)
+		]
+
+def make_request(fields=None):
+	query = {"fields": fields} if fields else {}
+	return Request(factory.get("/", query))
+
+def serialize(serializer_class, objs, request):
+	return serializer_class(objs, many=True, context={"request": request}).data
+
+def serialize_rows(serializer_class, queryset, request):
+	serializer = serializer_class(context={"request": request})
+	columns = serializer.get_columns()
+	rows = queryset.values_list(*[column for name, column, convert in columns])
+	return serializer.represent_rows(rows, columns)
+
+def run():
+	results = {}
+	request = make_request()
+	sparse_request = make_request("name,missing")
+	for size in SIZES:
+		objs = [CModel(id=i, name="name{}".format(i)) for i in range(size)]
+		for name, serializer_class in SERIALIZERS:
+			results["serializer.{}.{}".format(name, size)] = \
+					measure(lambda: serialize(serializer_class, objs, request)) / size
+		results["serializer.sane_sparse.{}".format(size)] = \
+				measure(lambda: serialize(SaneSerializer, objs, sparse_request)) / size
+
+		comments = [Comment(id=i, content="comment{}".format(i)) for i in range(size)]
+		results["serializer.sane_permissions.{}".format(size)] = \
+				measure(lambda: serialize(PermissionSerializer, comments, request)) / size
+
+	CModel.objects.bulk_create \
+			(CModel(name="name{}".format(i)) for i in range(max(SIZES)))
+	for size in SIZES:
+		queryset = CModel.objects.order_by("id")[:size]
+		results["serializer.db_objects.{}".format(size)] = \
+				measure(lambda: serialize(SaneSerializer, queryset.all(), request)) / size
+		results["serializer.db_columns.{}".format(size)] = \
+				measure(lambda: serialize_rows(SaneSerializer, queryset.all(), request)) / size
+	CModel.objects.all().delete()
+	return results
+
+if __name__ == "__main__":
+	for name, seconds in sorted(run().items()):
+		print("{:<32} {:>12.3f} us/row".format(name, seconds * 1000000))
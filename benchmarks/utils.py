@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+
+import django
+
+
+_is_setup = False
+
+def setup_django():
+	"""
+	Sets up Django with test settings and an in-memory test database.
+	"""
+	global _is_setup
+	if _is_setup:
+		return
+	_is_setup = True
+
+	sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+	django.setup()
+
+	from django.db import connection
+	from django.test.utils import setup_test_environment
+	setup_test_environment()
+	# sqlite test database lives in memory
+	connection.creation.create_test_db(verbosity=0)
+
+def measure(func, number=None, min_time=0.2):
+	"""
+	Returns the best time per call in seconds. If 'number' is not given,
+	it is picked so that a round takes at least 'min_time' seconds.
+	"""
+	if number is None:
+		number = 1
+		while True:
+			start = time.perf_counter()
+			for _ in range(number):
+				func()
+			if time.perf_counter() - start >= min_time:
+				break
+			number *= 2
+
+	best = None
+	for _ in range(3):
+		start = time.perf_counter()
+		for _ in range(number):
+			func()
+		elapsed = (time.perf_counter() - start) / number
+		best = elapsed if best is None else min(best, elapsed)
+	return best
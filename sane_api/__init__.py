@@ -0,0 +1 @@
+default_app_config = "sane_api.apps.SaneAPIConfig"
@@ -7,18 +7,32 @@ from rest_framework.viewsets import (ModelViewSet, ViewSet, )
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import list_route
-from rest_framework.test import APIClient
+from rest_framework.settings import api_settings
+from rest_framework.serializers import BaseSerializer, ListSerializer, RelatedField
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
 
 from sane_api.serializers import CompositeRequestSerializer
 from sane_api.exceptions import SaneException, CyclicDependency, UnmetDependency
+from sane_api.dispatchers import InProcessDispatcher
+from sane_api.renderers import NDJSONRenderer
+from sane_api.metrics import ComposeMeter
 from sane_api.helpers import \
-		( get_cyclic_dependency
-		, get_unmet_dependency
+		( get_dependency_graph
+		, get_cyclic_dependencies
+		, get_unmet_dependencies
+		, iter_requests
 		, make_requests
+		, make_requests_async
+		, run_until_complete
+		, compile_template
 		)
 
 
 class SanePermissionClass:
+	# authorizer names, or None if absent, by classes and actions
+	authorizer_names = {}
+
 	def _get_action_name(self, view, request):
 		return view.action or request.method.lower()
 
@@ -26,10 +40,19 @@ class SanePermissionClass:
 		instance = obj or view
 		action_name = self._get_action_name(view, request)
 
+		key = (type(instance), action_name)
 		try:
-			return getattr(instance, "can_{}".format(action_name))
-		except AttributeError as e:
+			authorizer_name = self.authorizer_names[key]
+		except KeyError:
+			authorizer_name = "can_{}".format(action_name)
+			if not hasattr(instance, authorizer_name):
+				authorizer_name = None
+			self.authorizer_names[key] = authorizer_name
+
+		if authorizer_name is None:
 			return None
+		# authorizers are looked up on every call, so patched ones are used
+		return getattr(instance, authorizer_name, None)
 
 	def has_permission(self, request, view):
 		authorizer = self._get_authorizer(request, view)
@@ -42,43 +65,318 @@ class SanePermissionClass:
 class SaneAPIMixin:
 	permission_classes = [SanePermissionClass]
 
+def _get_field_name(model_field):
+	"""
+	Returns name of the model field as read from its instances.
+	"""
+	if model_field.auto_created and not model_field.concrete:
+		# reverse relations are read by their accessors
+		return model_field.get_accessor_name()
+	return model_field.name
+
+def _get_serializer_fields(serializer):
+	if isinstance(serializer, ListSerializer):
+		serializer = serializer.child
+	return [field for field in serializer.fields.values() if not field.write_only]
+
 class SaneModelAPI(SaneAPIMixin, ModelViewSet):
+	only_requested_fields = True
+	prefetch_related_fields = True
+	columnar_list = False
+
 	def get_queryset(self):
 		raise Exception("Please implement .get_queryset() and tailor it for specific user/group.")
 
+	def list(self, request, *args, **kwargs):
+		"""
+		Serializes rows of values instead of objects if 'columnar_list' is
+		True and final fields of the serializer only read model columns.
+		"""
+		serializer = self.get_serializer() if self.columnar_list else None
+		columns = None if serializer is None else self.get_columns(serializer)
+		if columns is None:
+			return super(SaneModelAPI, self).list(request, *args, **kwargs)
+
+		queryset = self.filter_queryset(self.get_queryset())
+		rows = queryset.values_list(*[column for name, column, convert in columns])
+		page = self.paginate_queryset(rows)
+		if page is not None:
+			return self.get_paginated_response(serializer.represent_rows(page, columns))
+		return Response(serializer.represent_rows(rows, columns))
+
+	def get_serializer_context(self):
+		"""
+		Lets serializers of the request share their field plans, so fields
+		are planned once per request.
+		"""
+		context = super(SaneModelAPI, self).get_serializer_context()
+		context["field_plans"] = self.__dict__.setdefault("field_plans", {})
+		return context
+
+	def get_columns(self, serializer):
+		# paginations import apis through indexes
+		from sane_api.paginations import SaneKeysetPagination
+
+		if isinstance(self.paginator, SaneKeysetPagination):
+			# cursors are read from objects
+			return None
+		if not hasattr(serializer, "get_columns"):
+			return None
+		return serializer.get_columns()
+
+	def filter_queryset(self, queryset):
+		queryset = super(SaneModelAPI, self).filter_queryset(queryset)
+		queryset = self.filter_authorized(queryset)
+		if self.request.method != "GET":
+			return queryset
+
+		try:
+			serializer = self.get_serializer()
+		except AssertionError:
+			# views without serializer, e.g. destroying ones
+			return queryset
+
+		lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+		if self.only_requested_fields and lookup_url_kwarg not in self.kwargs:
+			# single objects are also read by their authorizers
+			only_fields = self.get_only_fields(serializer, queryset.model)
+			if only_fields:
+				queryset = queryset.only(*only_fields)
+		if self.prefetch_related_fields:
+			select_related, prefetch_related = \
+					self.get_related_lookups(serializer, queryset.model)
+			if select_related:
+				queryset = queryset.select_related(*select_related)
+			if prefetch_related:
+				queryset = queryset.prefetch_related(*prefetch_related)
+		return queryset
+
+	def filter_authorized(self, queryset):
+		"""
+		Keeps objects which the user is authorized for in list and bulk
+		actions, if the model has a 'permission_q(action, user)' classmethod.
+		It returns a Q object, or None to keep every object.
+		"""
+		model = queryset.model
+		lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+		if not hasattr(model, "permission_q") or lookup_url_kwarg in self.kwargs:
+			# single objects are authorized by their authorizers
+			return queryset
+
+		action_name = self.action or self.request.method.lower()
+		q = model.permission_q(action_name, self.request.user)
+		return queryset if q is None else queryset.filter(q)
+
+	def get_only_fields(self, serializer, model):
+		"""
+		Returns model fields which are needed by final fields of the
+		serializer, or None if they are not known, e.g. if a field reads a
+		property or the whole object.
+		"""
+		if getattr(serializer, "final_fields", None) is None:
+			return None
+
+		columns = {"pk": model._meta.pk.name}
+		for field in model._meta.get_fields():
+			if field.concrete:
+				columns[field.name] = field.name
+				columns[field.attname] = field.name
+			elif field.one_to_many or field.many_to_many or field.one_to_one:
+				# reverse relations are read from their own tables
+				columns[_get_field_name(field)] = None
+
+		only_fields = [model._meta.pk.name]
+		for field in _get_serializer_fields(serializer):
+			name = field.source.split(".")[0]
+			if name not in columns:
+				return None
+			if columns[name] and columns[name] not in only_fields:
+				only_fields.append(columns[name])
+		return only_fields
+
+	def get_related_lookups(self, serializer, model):
+		"""
+		Returns lookups of select_related() and prefetch_related() for the
+		relations which readable fields of the serializer, and of its nested
+		serializers, read.
+		"""
+		relations = dict \
+				( (_get_field_name(field), field)
+				for field in model._meta.get_fields()
+				if field.is_relation and field.related_model is not None
+				)
+
+		select_related, prefetch_related = [], []
+		for field in _get_serializer_fields(serializer):
+			name = field.source.split(".")[0]
+			relation = relations.get(name)
+			if relation is None:
+				continue
+
+			nested = field.child if isinstance(field, ListSerializer) else field
+			if isinstance(nested, BaseSerializer):
+				nested_select, nested_prefetch = \
+						self.get_related_lookups(nested, relation.related_model)
+			else:
+				nested_select, nested_prefetch = [], []
+
+			if relation.many_to_one or relation.one_to_one:
+				is_pk_only = isinstance(field, RelatedField) \
+						and field.use_pk_only_optimization()
+				if "." in field.source or not is_pk_only:
+					select_related.append(name)
+					select_related.extend \
+							("{}__{}".format(name, lookup) for lookup in nested_select)
+					prefetch_related.extend \
+							( Prefetch
+									( "{}__{}".format(name, lookup.prefetch_through)
+									, queryset=lookup.queryset
+									)
+							for lookup in nested_prefetch
+							)
+			else:
+				queryset = relation.related_model._default_manager.all()
+				if nested_select:
+					queryset = queryset.select_related(*nested_select)
+				if nested_prefetch:
+					queryset = queryset.prefetch_related(*nested_prefetch)
+				prefetch_related.append(Prefetch(name, queryset=queryset))
+		return select_related, prefetch_related
+
 class SaneAPI(SaneAPIMixin, ViewSet):
 	pass
 
 
 class HelperAPI(SaneAPI):
+	renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [NDJSONRenderer]
+	compose_dispatcher_class = InProcessDispatcher
+	compose_cache = None
+	compose_coalesce = False
+	compose_max_workers = 1
+	compose_batch_size = 100
+	compose_max_fanout = 10
+	compose_async = False
+	compose_timeout = None
+	compose_request_timeout = None
+	compose_instrument = False
+	compose_measure_size = False
+	compose_metrics_sink = None
+
 	@list_route(methods=["post"])
 	def compose(self, request):
-		data = request.data
+		data = dict \
+				( (key, compile_template(value))
+				for key, value in request.data.items()
+				)
 
 		# check for cyclic and unmet dependencies
-		cyclic_dependency = get_cyclic_dependency(data)
-		if cyclic_dependency:
-			msg = "'{}' has cyclic dependency.".format(cyclic_dependency)
+		graph = get_dependency_graph(data)
+		cyclic_dependencies = get_cyclic_dependencies(data, graph)
+		if cyclic_dependencies:
+			msg = " ".join \
+					( "'{}' has cyclic dependency.".format(key)
+					for key in cyclic_dependencies
+					)
 			return Response({"detail": msg}, status = 400)
-		unmet_dependency = get_unmet_dependency(data)
-		if unmet_dependency:
-			msg =  "'{}' has unmet dependency '{}'.".format(unmet_dependency[0], unmet_dependency[1])
+		unmet_dependencies = get_unmet_dependencies(data, graph)
+		if unmet_dependencies:
+			msg = " ".join \
+					( "'{}' has unmet dependency '{}'.".format(key, dependency)
+					for key, dependency in unmet_dependencies
+					)
 			return Response({"detail": msg}, status = 400)
 
-		# authenticate if user exists
-		client = APIClient()
-		if request.user and request.user.is_authenticated():
-			client.force_authenticate(request.user)
+		meter = self.get_meter()
+		if meter is not None and "meta" in request.query_params and "_meta" in data:
+			return Response \
+					( {"detail": "'_meta' is reserved for measurements of the apis."}
+					, status = 400
+					)
+		dispatcher = self.get_dispatcher(meter)
 
 		request_signatures = []
-		for key, value in request.data.items():
+		for key, value in data.items():
 			request_signatures.append([key, value])
 
+		if request.accepted_renderer.format == NDJSONRenderer.format:
+			return StreamingHttpResponse \
+					( self.stream_responses(dispatcher, request_signatures, meter)
+					, content_type=NDJSONRenderer.media_type
+					)
+
 		try:
-			responses = make_requests(client, request_signatures, responses={}, pendings=[])
+			if self.compose_async:
+				responses = run_until_complete(make_requests_async \
+						( dispatcher
+						, request_signatures
+						, max_workers=self.compose_max_workers
+						, timeout=self.compose_timeout
+						, request_timeout=self.compose_request_timeout
+						, meter=meter
+						))
+			else:
+				responses = make_requests \
+						( dispatcher
+						, request_signatures
+						, max_workers=self.compose_max_workers
+						, meter=meter
+						)
 		except SaneException as e:
 			return Response({"detail": e.message}, status=400)
-		return Response(responses, status=200)
+
+		headers = {}
+		if meter is not None:
+			self.flush_meter(meter)
+			headers["Server-Timing"] = meter.server_timing()
+			if "meta" in request.query_params:
+				responses["_meta"] = meter.records
+		return Response(responses, status=200, headers=headers)
+
+	def get_meter(self):
+		"""
+		Returns a meter of sub-requests if they are instrumented, i.e. if
+		'compose_instrument' is True or a metrics sink is given.
+		"""
+		if self.compose_instrument or self.compose_metrics_sink is not None:
+			return ComposeMeter(measure_size=self.compose_measure_size)
+		return None
+
+	def flush_meter(self, meter):
+		if self.compose_metrics_sink is not None:
+			meter.flush(self.compose_metrics_sink)
+
+	def get_dispatcher(self, meter=None):
+		return self.compose_dispatcher_class \
+				( self.request
+				, coalesce=self.compose_coalesce
+				, cache=self.compose_cache
+				, batch_size=self.compose_batch_size
+				, max_fanout=self.compose_max_fanout
+				, meter=meter
+				)
+
+	def stream_responses(self, dispatcher, request_signatures, meter=None):
+		"""
+		Yields a line of newline delimited JSON for every response as soon
+		as it is ready.
+		"""
+		renderer = NDJSONRenderer()
+		try:
+			for key, response in iter_requests \
+					( dispatcher
+					, request_signatures
+					, max_workers=self.compose_max_workers
+					, meter=meter
+					):
+				yield renderer.render({key: response})
+		except SaneException as e:
+			yield renderer.render({"detail": e.message})
+			return
+
+		if meter is not None:
+			self.flush_meter(meter)
+			if "meta" in self.request.query_params:
+				yield renderer.render({"_meta": meter.records})
 
 	def can_compose(self, user, request):
 		return True
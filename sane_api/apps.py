@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.core import checks
+
+
+class SaneAPIConfig(AppConfig):
+	name = "sane_api"
+	verbose_name = "Sane API"
+
+	def ready(self):
+		from sane_api.checks import check_authorizers
+		checks.register(check_authorizers, checks.Tags.urls)
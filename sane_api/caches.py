@@ -0,0 +1,135 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from rest_framework.renderers import JSONRenderer
+
+
+class ComposeCache:
+	"""
+	Caches responses of compose sub-requests. Entries of a model are
+	invalidated by bumping version of the model on its save and delete.
+	"""
+	def __init__(self, timeout=300):
+		self.timeout = timeout
+		self.watched = set()
+		self.watch_lock = threading.Lock()
+
+	def get(self, key):
+		raise NotImplementedError("Please implement .get() of the cache.")
+
+	def set(self, key, entry, timeout):
+		raise NotImplementedError("Please implement .set() of the cache.")
+
+	def get_version(self, label):
+		raise NotImplementedError("Please implement .get_version() of the cache.")
+
+	def bump_version(self, label):
+		raise NotImplementedError("Please implement .bump_version() of the cache.")
+
+	def make_key(self, *parts):
+		return "sane_api:compose:{}".format(hashlib.sha1(repr(parts).encode()).hexdigest())
+
+	def prepare(self, data):
+		"""
+		Returns plain copy of the data which is safe to share and pickle.
+		"""
+		return json.loads(JSONRenderer().render(data).decode())
+
+	def watch(self, model):
+		"""
+		Invalidates entries of the model when its instances change. Signals
+		are connected once per model.
+		"""
+		label = model._meta.label_lower
+		if label in self.watched:
+			return label
+
+		def invalidate(sender, **kwargs):
+			self.bump_version(label)
+
+		with self.watch_lock:
+			if label not in self.watched:
+				dispatch_uid = "sane_api.caches.{}.{}".format(id(self), label)
+				post_save.connect \
+						(invalidate, sender=model, weak=False, dispatch_uid=dispatch_uid)
+				post_delete.connect \
+						(invalidate, sender=model, weak=False, dispatch_uid=dispatch_uid)
+				self.watched.add(label)
+		return label
+
+
+class LocMemComposeCache(ComposeCache):
+	"""
+	Caches entries in memory of the process, evicting least recently used
+	ones beyond 'maxsize'.
+	"""
+	def __init__(self, timeout=300, maxsize=1024):
+		super(LocMemComposeCache, self).__init__(timeout)
+		self.maxsize = maxsize
+		self.entries = OrderedDict()
+		self.versions = {}
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			item = self.entries.get(key)
+			if item is None:
+				return None
+			expires, entry = item
+			if expires is not None and expires <= time.time():
+				del self.entries[key]
+				return None
+			self.entries.move_to_end(key)
+			return entry
+
+	def set(self, key, entry, timeout):
+		expires = None if timeout is None else time.time() + timeout
+		with self.lock:
+			self.entries[key] = (expires, entry)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.maxsize:
+				self.entries.popitem(last=False)
+
+	def get_version(self, label):
+		with self.lock:
+			return self.versions.get(label, 0)
+
+	def bump_version(self, label):
+		with self.lock:
+			self.versions[label] = self.versions.get(label, 0) + 1
+
+
+class DjangoComposeCache(ComposeCache):
+	"""
+	Caches entries in a cache of Django's cache framework.
+	"""
+	def __init__(self, timeout=300, alias="default"):
+		super(DjangoComposeCache, self).__init__(timeout)
+		self.alias = alias
+
+	@property
+	def cache(self):
+		return caches[self.alias]
+
+	def get(self, key):
+		return self.cache.get(key)
+
+	def set(self, key, entry, timeout):
+		self.cache.set(key, entry, timeout)
+
+	def get_version(self, label):
+		return self.cache.get(self.make_key("version", label), 0)
+
+	def bump_version(self, label):
+		key = self.make_key("version", label)
+		self.cache.add(key, 0, None)
+		try:
+			self.cache.incr(key)
+		except ValueError:
+			# evicted in between
+			self.cache.set(key, 1, None)
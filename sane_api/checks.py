@@ -0,0 +1,40 @@
+from django.core import checks
+from django.urls import get_resolver
+
+from sane_api.apis import SaneAPIMixin
+
+
+def get_routed_actions(patterns):
+	"""
+	Yields [viewset class, action] of every routed action of the patterns.
+	"""
+	for pattern in patterns:
+		if hasattr(pattern, "url_patterns"):
+			yield from get_routed_actions(pattern.url_patterns)
+			continue
+		view_class = getattr(pattern.callback, "cls", None)
+		actions = getattr(pattern.callback, "actions", None) or {}
+		for action in actions.values():
+			yield view_class, action
+
+def check_authorizers(app_configs=None, **kwargs):
+	"""
+	Warns about routed actions of Sane apis which have no authorizer, as
+	they are inaccessible.
+	"""
+	errors = []
+	seen = set()
+	for view_class, action in get_routed_actions(get_resolver().url_patterns):
+		if view_class is None or not issubclass(view_class, SaneAPIMixin) \
+				or (view_class, action) in seen:
+			continue
+		seen.add((view_class, action))
+		if not hasattr(view_class, "can_{}".format(action)):
+			errors.append(checks.Warning \
+					( "'{}' has no authorizer 'can_{}' for its action '{}'." \
+							.format(view_class.__name__, action, action)
+					, hint="Implement 'can_{}' or remove the action.".format(action)
+					, obj=view_class
+					, id="sane_api.W001"
+					))
+	return errors
@@ -0,0 +1,400 @@
+import io
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.parse import urlparse, parse_qsl, unquote_to_bytes
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import Http404
+from django.utils.cache import get_max_age
+from django.urls import get_resolver, get_urlconf, Resolver404
+from django.utils.http import urlencode
+from rest_framework.serializers import ModelSerializer
+from rest_framework.test import APIClient
+
+from sane_api.exceptions import ExcessiveFanOut, AmbiguousBatch
+
+
+class ResolveCache:
+	"""
+	LRU cache of url resolutions, i.e. view functions with their args,
+	kwargs and actions. It is dropped whenever Django rebuilds its url
+	resolver, e.g. when urlconf changes.
+	"""
+	def __init__(self, maxsize=512):
+		self.maxsize = maxsize
+		self.resolver = None
+		self.matches = OrderedDict()
+		self.lock = threading.Lock()
+
+	def resolve(self, path):
+		urlconf = get_urlconf()
+		resolver = get_resolver(urlconf)
+		key = (urlconf, path)
+		with self.lock:
+			if resolver is not self.resolver:
+				self.matches.clear()
+				self.resolver = resolver
+			match = self.matches.get(key)
+			if match is not None:
+				self.matches.move_to_end(key)
+				return match
+
+		match = resolver.resolve(path)
+		with self.lock:
+			if resolver is self.resolver:
+				self.matches[key] = match
+				while len(self.matches) > self.maxsize:
+					self.matches.popitem(last=False)
+		return match
+
+	def clear(self):
+		with self.lock:
+			self.matches.clear()
+
+resolve_cache = ResolveCache()
+
+
+class Memo:
+	"""
+	Shares results of calls by keys. Callers of a key which is in flight
+	wait for its result instead of calling again. Results are forgotten
+	as soon as calls are done unless 'keep' is True.
+	"""
+	def __init__(self, keep=True):
+		self.keep = keep
+		self.futures = {}
+		self.lock = threading.Lock()
+
+	def call(self, key, func, *args):
+		with self.lock:
+			future = self.futures.get(key)
+			is_owner = future is None
+			if is_owner:
+				future = self.futures[key] = Future()
+		if not is_owner:
+			return future.result()
+
+		try:
+			result = func(*args)
+		except BaseException as e:
+			future.set_exception(e)
+			raise
+		else:
+			future.set_result(result)
+			return result
+		finally:
+			if not self.keep:
+				with self.lock:
+					del self.futures[key]
+
+# coalesces identical requests of concurrent composite requests
+in_flight = Memo(keep=False)
+
+def get_nested_models(serializer_class, models=None):
+	"""
+	Returns models of serializers which are nested in the serializer class.
+	"""
+	models = [] if models is None else models
+	for field in getattr(serializer_class, "_declared_fields", {}).values():
+		field = getattr(field, "child", field)
+		if isinstance(field, ModelSerializer) and field.Meta.model not in models:
+			models.append(field.Meta.model)
+			get_nested_models(type(field), models)
+	return models
+
+
+class Dispatcher:
+	"""
+	Makes GET sub-requests of a composite request on behalf of its user.
+	Identical sub-requests are made once per composite request. If
+	'coalesce' is True, identical sub-requests of concurrent composite
+	requests of a user are made once as well. If 'cache' is given,
+	responses are cached across composite requests. Batched sub-requests
+	are split into chunks of at most 'batch_size' values and at most
+	'max_fanout' sub-requests. Cache hits and misses are reported to the
+	'meter' if it is given.
+	"""
+	in_flight = in_flight
+	resolve_cache = resolve_cache
+	# models by view classes
+	view_models = {}
+
+	def __init__ \
+			( self, request, coalesce=False, cache=None
+			, batch_size=100, max_fanout=10, meter=None
+			):
+		self.request = request
+		self.coalesce = coalesce
+		self.cache = cache
+		self.batch_size = batch_size
+		self.max_fanout = max_fanout
+		self.meter = meter
+		self.memo = Memo()
+
+	def get(self, url, query):
+		"""
+		Returns data of the response if it succeeds else returns None.
+		"""
+		key = self.get_key(url, query)
+		if self.coalesce:
+			return self.memo.call \
+					( key, self.in_flight.call
+					, (self.get_scope(), key), self.fetch, url, query
+					)
+		return self.memo.call(key, self.fetch, url, query)
+
+	def get_batched(self, url, query, batch_size=None):
+		"""
+		Makes a sub-request for every chunk of the list valued query param
+		and returns their merged data. Chunks are fetched one after another
+		by the calling thread, which is already one of the workers of the
+		composite request if it has any.
+		"""
+		names = [name for name, value in query.items() if isinstance(value, list)]
+		if not names:
+			return self.get(url, query)
+		if len(names) > 1:
+			raise AmbiguousBatch(url, sorted(names))
+
+		name = names[0]
+		values = list(OrderedDict.fromkeys(str(value) for value in query[name]))
+		if not values:
+			return []
+		size = min(batch_size or self.batch_size, self.batch_size)
+		chunks = [values[i:i + size] for i in range(0, len(values), size)]
+		if len(chunks) > self.max_fanout:
+			raise ExcessiveFanOut(url, len(chunks), self.max_fanout)
+		if len(chunks) == 1:
+			return self.get(url, dict(query, **{name: ",".join(chunks[0])}))
+		return self.merge \
+				([self.get(url, dict(query, **{name: ",".join(chunk)})) for chunk in chunks])
+
+	def merge(self, results):
+		"""
+		Merges data of batched sub-requests. Lists and paginated results
+		are concatenated.
+		"""
+		if any(result is None for result in results):
+			return None
+		if all(isinstance(result, list) for result in results):
+			return [item for result in results for item in result]
+		if all(isinstance(result, dict) and isinstance(result.get("results"), list) \
+				for result in results):
+			merged = dict(results[0])
+			merged["results"] = [item for result in results for item in result["results"]]
+			if all("count" in result for result in results):
+				merged["count"] = sum(result["count"] for result in results)
+			for link in ("next", "previous", "next_cursor"):
+				if link in merged:
+					merged[link] = None
+			return merged
+		return results
+
+	def get_key(self, url, query):
+		"""
+		Returns normalized signature of the sub-request.
+		"""
+		parsed_url = urlparse(url)
+		params = parse_qsl(parsed_url.query, keep_blank_values=True)
+		for name, value in (query or {}).items():
+			values = value if isinstance(value, (list, tuple)) else [value]
+			params.extend((name, str(a_value)) for a_value in values)
+		# sort is stable, so order of repeated params is kept
+		return (parsed_url.path, tuple(sorted(params, key=lambda param: param[0])))
+
+	def get_scope(self):
+		user = self.request.user
+		return user.pk if user and user.is_authenticated else None
+
+	def fetch(self, url, query):
+		models = self.get_models(url) if self.cache is not None else []
+		if models:
+			return self.fetch_cached(url, query, models)
+		response = self.dispatch(url, query)
+		if response is None or response.status_code != 200:
+			return None
+		return self.get_data(response)
+
+	def fetch_cached(self, url, query, models):
+		"""
+		Returns data from the cache while it is fresh. Stale data with an
+		ETag is revalidated with the view. Data is invalidated when any of
+		the models changes.
+		"""
+		labels = tuple(self.cache.watch(model) for model in models)
+		versions = tuple(self.cache.get_version(label) for label in labels)
+		key = self.cache.make_key \
+				(self.get_cache_scope(), self.get_key(url, query), labels, versions)
+
+		entry = self.cache.get(key)
+		is_fresh = entry is not None and entry["fresh_until"] > time.time()
+		if self.meter is not None:
+			self.meter.record_cache(is_fresh)
+		if is_fresh:
+			return entry["data"]
+
+		headers = {}
+		if entry is not None and entry["etag"]:
+			headers["HTTP_IF_NONE_MATCH"] = entry["etag"]
+		response = self.dispatch(url, query, headers)
+		if response is None:
+			return None
+		if response.status_code == 304 and entry is not None:
+			self.store(key, entry["data"], entry["etag"], response)
+			return entry["data"]
+		if response.status_code != 200:
+			return None
+
+		data = self.get_data(response)
+		cache_control = response.get("Cache-Control", "")
+		is_shared = self.get_cache_scope() != self.get_scope()
+		if "no-store" not in cache_control \
+				and not ("private" in cache_control and is_shared):
+			data = self.store(key, self.cache.prepare(data), response.get("ETag"), response)
+		return data
+
+	def store(self, key, data, etag, response):
+		"""
+		Stores the data for as long as 'Cache-Control' of the response
+		allows. Data with an ETag is kept longer for revalidation.
+		"""
+		if "no-cache" in response.get("Cache-Control", ""):
+			ttl = 0
+		else:
+			max_age = get_max_age(response)
+			ttl = self.cache.timeout if max_age is None else max_age
+		timeout = max(ttl, self.cache.timeout) if etag else ttl
+		if timeout:
+			entry = {"data": data, "etag": etag, "fresh_until": time.time() + ttl}
+			self.cache.set(key, entry, timeout)
+		return data
+
+	def get_cache_scope(self):
+		"""
+		Returns scope of cached responses. Override it to share responses
+		between users of same permissions, e.g. by group.
+		"""
+		return self.get_scope()
+
+	def get_models(self, url):
+		"""
+		Returns models whose changes invalidate responses of the url, i.e.
+		model of the view which serves it, read from its queryset or its
+		serializer, and models of serializers nested in its serializer.
+		Responses of views of unknown models are not cached, so it returns
+		an empty list for them.
+		"""
+		try:
+			match = self.resolve_cache.resolve(urlparse(url).path)
+		except Resolver404:
+			return []
+		view_class = getattr(match.func, "cls", None)
+		if view_class in self.view_models:
+			return self.view_models[view_class]
+
+		queryset = getattr(view_class, "queryset", None)
+		serializer_class = getattr(view_class, "serializer_class", None)
+		model = getattr(queryset, "model", None)
+		if model is None and issubclass(serializer_class or object, ModelSerializer):
+			model = serializer_class.Meta.model
+		models = []
+		if model is not None:
+			models = [model] + [a_model for a_model in get_nested_models(serializer_class) \
+					if a_model is not model]
+		self.view_models[view_class] = models
+		return models
+
+	def dispatch(self, url, query, headers=None):
+		"""
+		Returns response of the sub-request, or None if nothing serves it.
+		"""
+		raise NotImplementedError("Please implement .dispatch() of the dispatcher.")
+
+	def get_data(self, response):
+		raise NotImplementedError("Please implement .get_data() of the dispatcher.")
+
+
+class ClientDispatcher(Dispatcher):
+	"""
+	Makes sub-requests through DRF's test client, i.e. through whole
+	middleware stack, rendering and parsing.
+	"""
+	def __init__(self, request, *args, **kwargs):
+		super(ClientDispatcher, self).__init__(request, *args, **kwargs)
+		self.client = APIClient()
+		if request.user and request.user.is_authenticated:
+			self.client.force_authenticate(request.user)
+
+	def dispatch(self, url, query, headers=None):
+		return self.client.get(url, query, format="json", **(headers or {}))
+
+	def get_data(self, response):
+		return response.json()
+
+
+class InProcessDispatcher(Dispatcher):
+	"""
+	Makes sub-requests by calling resolved views directly with a clone of
+	the request. Middlewares are not run again and the data of responses
+	is read without rendering and parsing them.
+	"""
+	excluded_meta = \
+			( "CONTENT_LENGTH"
+			, "CONTENT_TYPE"
+			, "HTTP_CONTENT_TYPE"
+			, "HTTP_IF_NONE_MATCH"
+			, "HTTP_IF_MODIFIED_SINCE"
+			)
+
+	def dispatch(self, url, query, headers=None):
+		parsed_url = urlparse(url)
+		try:
+			match = self.resolve_cache.resolve(parsed_url.path)
+		except Resolver404:
+			return None
+
+		query_string = "&".join \
+				(filter(None, [parsed_url.query, urlencode(query or {}, doseq=True)]))
+		request = self.clone_request(parsed_url.path, query_string, headers)
+		try:
+			return match.func(request, *match.args, **match.kwargs)
+		except Http404:
+			return None
+
+	def clone_request(self, path, query_string, headers=None):
+		"""
+		Returns a GET request for the path which carries headers and
+		authenticated user of the composite request.
+		"""
+		original = getattr(self.request, "_request", self.request)
+		environ = dict \
+				( (key, value)
+				for key, value in original.META.items()
+				if key not in self.excluded_meta
+				)
+		environ.update \
+				({ "REQUEST_METHOD": "GET"
+				 , "HTTP_ACCEPT": "application/json"
+				 # WSGI requires latin-1 decoded strings
+				 , "PATH_INFO": unquote_to_bytes(path).decode("iso-8859-1")
+				 , "QUERY_STRING": query_string
+				 , "wsgi.input": io.BytesIO(b"")
+				 })
+		environ.update(headers or {})
+
+		request = WSGIRequest(environ)
+		for attr in ("user", "session", "auth"):
+			if hasattr(original, attr):
+				setattr(request, attr, getattr(original, attr))
+		# skip authentication as the user is already authenticated
+		request._force_auth_user = self.request.user
+		request._force_auth_token = getattr(self.request, "auth", None)
+		return request
+
+	def get_data(self, response):
+		if hasattr(response, "data"):
+			return response.data
+		return json.loads(response.content.decode(response.charset))
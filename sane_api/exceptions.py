@@ -9,3 +9,13 @@ class UnmetDependency(SaneException):
 class CyclicDependency(SaneException):
 	def __init__(self, key):
 		self.message = "The request payload has cyclic dependency at '{}'.".format(key)
+
+class ExcessiveFanOut(SaneException):
+	def __init__(self, url, count, limit):
+		msg = "The request to '{}' fans out into {} requests, more than {}."
+		self.message = msg.format(url, count, limit)
+
+class AmbiguousBatch(SaneException):
+	def __init__(self, url, names):
+		msg = "The request to '{}' can batch only one of '{}'."
+		self.message = msg.format(url, "', '".join(names))
@@ -1,11 +1,52 @@
+import threading
+
 from django_filters.filterset import FilterSet
 
 
+def _get_fingerprint(filterables):
+	"""
+	Returns hashable form of the filterables.
+	"""
+	if isinstance(filterables, dict):
+		return tuple(sorted \
+				( (name, lookups if isinstance(lookups, str) else tuple(lookups))
+				for name, lookups in filterables.items()
+				))
+	if isinstance(filterables, str):
+		return filterables
+	return tuple(filterables)
+
+
 class SaneFilterSet(FilterSet):
+	# base filters by filter set classes and fingerprints of filterables
+	filters_cache = {}
+	filters_lock = threading.Lock()
+
 	def __init__(self, *args, **kwargs):
-		self._meta.fields = self.get_filterables()
-		self.base_filters = self.get_filters()
+		# lets filterables depend on the request
+		self.request = kwargs.get("request")
+		self.base_filters = self.get_base_filters(self.get_filterables())
 		super(SaneFilterSet, self).__init__(*args, **kwargs)
 
+	@classmethod
+	def get_base_filters(cls, filterables):
+		"""
+		Returns filters of the filterables. They are generated once, by a
+		subclass having the filterables as its fields, and reused after.
+		"""
+		key = (cls, _get_fingerprint(filterables))
+		base_filters = cls.filters_cache.get(key)
+		if base_filters is not None:
+			return base_filters
+
+		with cls.filters_lock:
+			base_filters = cls.filters_cache.get(key)
+			if base_filters is None:
+				meta = type("Meta", (getattr(cls, "Meta", object),), {"fields": filterables})
+				attrs = {"Meta": meta, "__module__": cls.__module__}
+				filterset_class = type(cls)(cls.__name__, (cls,), attrs)
+				base_filters = cls.filters_cache[key] = filterset_class.base_filters
+		return base_filters
+
 	def get_filterables(self):
 		raise Exception("Please implement this method to return different fields for different user/group.")
@@ -1,115 +1,538 @@
 import re
-import json
 import copy
-from functools import reduce
+import time
+import queue
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, FIRST_COMPLETED, wait
 
-from sane_api.exceptions import UnmetDependency
+from django.db import connections, close_old_connections
+from rest_framework.exceptions import ValidationError
+
+from sane_api.exceptions import UnmetDependency, CyclicDependency
 from sane_api.serializers import CompositeRequestSerializer
 
 
-def has_cyclic_dependency(data, entry_key, this_key):
-	if entry_key == this_key:
-		return True
+PLACEHOLDER_RE = re.compile(r"{([a-zA-Z0-9_.]+?)}")
 
-	try:
-		value = data[this_key or entry_key]
-	except KeyError:
-		# will be handled by unmet dependency check
-		return False
-	matches = re.findall(r"{([a-zA-Z0-9_.]+?)}", json.dumps(value))
-	for match in matches:
-		next_key = match.split(".")[0]
-		if has_cyclic_dependency(data, entry_key, next_key):
-			return True
-	return False
+def get_dependency_graph(data):
+	"""
+	Returns a dict which maps every key to the set of keys it depends upon.
+	"""
+	graph = {}
+	for key, value in data.items():
+		graph[key] = compile_template(value).dependencies
+	return graph
+
+def get_cyclic_dependencies(data, graph=None):
+	"""
+	Returns every key which is a part of cyclic dependency.
+	Uses Tarjan's strongly connected components algorithm, O(V+E).
+	"""
+	graph = graph if graph is not None else get_dependency_graph(data)
+	index = {}
+	lowlink = {}
+	stack = []
+	on_stack = set()
+	cyclic = set()
+
+	for root in graph:
+		if root in index:
+			continue
+		# iterative dfs so that deep chains do not hit recursion limit
+		work = [(root, iter(graph[root]))]
+		index[root] = lowlink[root] = len(index)
+		stack.append(root)
+		on_stack.add(root)
+		while work:
+			key, dependencies = work[-1]
+			for dependency in dependencies:
+				if dependency not in graph:
+					# will be handled by unmet dependency check
+					continue
+				if dependency not in index:
+					index[dependency] = lowlink[dependency] = len(index)
+					stack.append(dependency)
+					on_stack.add(dependency)
+					work.append((dependency, iter(graph[dependency])))
+					break
+				if dependency in on_stack:
+					lowlink[key] = min(lowlink[key], index[dependency])
+			else:
+				work.pop()
+				if work:
+					parent = work[-1][0]
+					lowlink[parent] = min(lowlink[parent], lowlink[key])
+				if lowlink[key] == index[key]:
+					component = []
+					while True:
+						member = stack.pop()
+						on_stack.discard(member)
+						component.append(member)
+						if member == key:
+							break
+					if len(component) > 1 or key in graph[key]:
+						cyclic.update(component)
+
+	return [key for key in data.keys() if key in cyclic]
 
 def get_cyclic_dependency(data):
 	"""
 	Returns root key which has cyclic dependency.
 	"""
-	for key, value in data.items():
-		if has_cyclic_dependency(data, key, this_key=None):
-			return key
-	return None
+	cyclic_dependencies = get_cyclic_dependencies(data)
+	return cyclic_dependencies[0] if cyclic_dependencies else None
+
+def get_unmet_dependencies(data, graph=None):
+	"""
+	Returns every [key, dependency] pair whose dependency is absent.
+	"""
+	graph = graph if graph is not None else get_dependency_graph(data)
+	unmet_dependencies = []
+	for key in data.keys():
+		for dependency in sorted(graph[key]):
+			if dependency not in graph:
+				unmet_dependencies.append([key, dependency])
+	return unmet_dependencies
 
 def get_unmet_dependency(data):
 	"""
 	Returns root key which has unmet dependency.
 	"""
-	for key, value in data.items():
-		matches = re.findall(r"{([a-zA-Z0-9_.]+?)}", json.dumps(value))
-		for match in matches:
+	unmet_dependencies = get_unmet_dependencies(data)
+	return unmet_dependencies[0] if unmet_dependencies else None
+
+def _flatten(nodes):
+	"""
+	Returns nodes with nested lists flattened in order and whether there
+	was any list.
+	"""
+	if not any(isinstance(node, list) for node in nodes):
+		return nodes, False
+
+	flattened = []
+	stack = list(reversed(nodes))
+	while stack:
+		node = stack.pop()
+		if isinstance(node, list):
+			stack.extend(reversed(node))
+		else:
+			flattened.append(node)
+	return flattened, True
+
+def get_value_at(path, source, start=False, collection=None):
+	"""
+	Returns value at the path. Values within lists are joined with comma
+	unless 'collection' (e.g. list or set) is given to collect them into.
+	A value which is not within a list is returned as it is.
+	"""
+	nodes = [source]
+	many = False
+	for depth, key in enumerate(path):
+		nodes, has_list = _flatten(nodes)
+		many = many or has_list
+		values = []
+		for node in nodes:
 			try:
-				dependency = match.split(".")[0]
-				data[dependency]
-			except KeyError:
-				return [key, dependency]
-	return None
+				values.append(node[key])
+			except (KeyError, IndexError, TypeError):
+				if start and depth == 0:
+					raise KeyError(key)
+				raise UnmetDependency(path[:depth + 1])
+		nodes = values
 
-def get_value_at(path, source, start=False, walked=[]):
-	if type(source) is list:
-		dlist = map\
-				(lambda x: get_value_at\
-					(copy.deepcopy(path), x, start, walked), source)
-		return reduce(lambda x, y: "{},{}".format(x,y), dlist)
+	nodes, has_list = _flatten(nodes)
+	if not (many or has_list):
+		return nodes[0]
+	if collection is not None:
+		return collection(nodes)
+	return ",".join(str(node) for node in nodes)
 
-	if len(path) == 0:
-		return source
+class Template:
+	"""
+	Compiled request signature. It records the location and the parsed
+	path of every placeholder so that filling writes values straight
+	into their slots without re-serializing the signature.
+	"""
+	def __init__(self, req_sig):
+		self.req_sig = req_sig
+		self.slots = []
+		self._compile(req_sig, ())
+		self.dependencies = set \
+				( part[0]
+				for location, parts in self.slots
+				for part in parts
+				if type(part) is list
+				)
 
-	this_path = path.pop(0)
-	walked.append(this_path)
+	def _compile(self, value, location):
+		if isinstance(value, dict):
+			for key, item in value.items():
+				self._compile(item, location + (key,))
+		elif isinstance(value, list):
+			for index, item in enumerate(value):
+				self._compile(item, location + (index,))
+		elif isinstance(value, str):
+			# odd parts are placeholder paths
+			parts = PLACEHOLDER_RE.split(value)
+			if len(parts) > 1:
+				parts = [part.split(".") if i % 2 else part for i, part in enumerate(parts)]
+				self.slots.append((location, [part for part in parts if part != ""]))
 
-	try:
-		return get_value_at\
-				(path, source[this_path], walked=walked)
-	except KeyError as e:
-		if not start:
-			raise UnmetDependency(walked)
-		raise e
+	def fill(self, responses, collection=None):
+		"""
+		Returns filled request signature else returns None if the
+		template is not fillable due to dependencies. Placeholders which
+		make up a whole value and go through lists are filled with
+		'collection' of values if it is given.
+		"""
+		if not self.slots:
+			return self.req_sig
+
+		values = []
+		for location, parts in self.slots:
+			try:
+				if collection is not None and len(parts) == 1 and type(parts[0]) is list:
+					values.append(get_value_at \
+							(parts[0], responses, start=True, collection=collection))
+					continue
+				values.append("".join \
+						( part if type(part) is str \
+							else str(get_value_at(part, responses, start=True))
+						for part in parts
+						))
+			except KeyError:
+				return None
+
+		filled = copy.copy(self.req_sig)
+		copied = set()
+		for (location, parts), value in zip(self.slots, values):
+			if not location:
+				return value
+			container = filled
+			for key in location[:-1]:
+				child = container[key]
+				if id(child) not in copied:
+					child = copy.copy(child)
+					copied.add(id(child))
+					container[key] = child
+				container = child
+			container[location[-1]] = value
+		return filled
+
+def compile_template(req_sig):
+	if isinstance(req_sig, Template):
+		return req_sig
+	return Template(req_sig)
 
 def fill_template(req_sig, responses):
 	"""
 	Fills the template and returns filled request signature else
 	returns None if template is not fillable due to dependencies.
 	"""
-	req_sig_str = json.dumps(req_sig)
-	matches = re.findall(r"{([a-zA-Z0-9\.]+)}", req_sig_str)
-	for match in matches:
-		path = match.split(".")
-		pattern = "{" + match + "}"
-		try:
-			value = get_value_at\
-					(copy.deepcopy(path), responses, start=True, walked=[])
-			req_sig = json.loads\
-					(json.dumps(req_sig).replace(pattern, str(value)))
-		except KeyError:
-			return None
+	return compile_template(req_sig).fill(responses)
 
-	return req_sig
+def get_dependency_levels(data, graph=None):
+	"""
+	Returns keys grouped in levels such that every key only depends upon
+	the keys of previous levels. Keys within a level are independent.
+	"""
+	graph = graph if graph is not None else get_dependency_graph(data)
+	dependents = dict((key, []) for key in graph)
+	in_degree = {}
+	for key, dependencies in graph.items():
+		dependencies = dependencies & set(graph.keys())
+		in_degree[key] = len(dependencies)
+		for dependency in dependencies:
+			dependents[dependency].append(key)
 
-def make_requests(client, req_sigs, responses={}, pendings=[]):
-	if len(req_sigs) == 0:
-		return responses
+	levels = []
+	level = [key for key in data.keys() if in_degree[key] == 0]
+	while level:
+		levels.append(level)
+		next_level = []
+		for key in level:
+			for dependent in dependents[key]:
+				in_degree[dependent] -= 1
+				if in_degree[dependent] == 0:
+					next_level.append(dependent)
+		level = next_level
+	return levels
 
-	key, req_sig = req_sigs.pop(0)
-	processed_sig = fill_template(req_sig, responses)
-	if not processed_sig:
-		pendings.append(key)
-		req_sigs.append([key, req_sig])
+def is_batched(req_sig):
+	"""
+	Tells if the request signature asks for batching, reading 'batch' the
+	way CompositeRequestSerializer validates it. An invalid one is left
+	for the serializer to report.
+	"""
+	if not isinstance(req_sig, dict) or "batch" not in req_sig:
+		return False
+	try:
+		return CompositeRequestSerializer._declared_fields["batch"] \
+				.to_internal_value(req_sig["batch"])
+	except ValidationError:
+		return False
+
+def make_request(dispatcher, req_sig, responses):
+	"""
+	Fills the request signature and returns the response of the request.
+	A batched request is filled with lists of values to be batched.
+	"""
+	template = compile_template(req_sig)
+	if is_batched(template.req_sig):
+		processed_sig = template.fill(responses, collection=list)
 	else:
-		s = CompositeRequestSerializer(data = processed_sig)
-		if not s.is_valid():
-			responses[key] = s.errors
-
-		response = client.get \
-				( s.validated_data["url"]
-				, s.validated_data.get("query", {})
-				, format="json"
+		processed_sig = template.fill(responses)
+	s = CompositeRequestSerializer(data = processed_sig)
+	if not s.is_valid():
+		return s.errors
+
+	url = s.validated_data["url"]
+	query = s.validated_data.get("query", {})
+	if s.validated_data.get("batch"):
+		return dispatcher.get_batched(url, query, s.validated_data.get("batch_size"))
+	return dispatcher.get(url, query)
+
+def _make_measured_request(dispatcher, req_sig, responses, meter, key, queued_at):
+	if meter is None:
+		return make_request(dispatcher, req_sig, responses)
+	return meter.measure(key, queued_at, make_request, dispatcher, req_sig, responses)
+
+class ComposeExecutor(Executor):
+	"""
+	A pool of at most 'max_workers' threads. Threads keep their database
+	connections across requests for as long as CONN_MAX_AGE allows, as
+	threads of a server do, and close them when the pool shuts down.
+	"""
+	def __init__(self, max_workers, daemon=False):
+		self.max_workers = max_workers
+		self.daemon = daemon
+		self.work = queue.Queue()
+		self.threads = []
+		self.lock = threading.Lock()
+
+	def submit(self, fn, *args, **kwargs):
+		future = Future()
+		with self.lock:
+			self.work.put((future, fn, args, kwargs))
+			if len(self.threads) < self.max_workers:
+				thread = threading.Thread(target=self.run_worker, daemon=self.daemon)
+				thread.start()
+				self.threads.append(thread)
+		return future
+
+	def run_worker(self):
+		try:
+			while True:
+				item = self.work.get()
+				if item is None:
+					break
+				future, fn, args, kwargs = item
+				if not future.set_running_or_notify_cancel():
+					continue
+				try:
+					future.set_result(fn(*args, **kwargs))
+				except BaseException as e:
+					future.set_exception(e)
+				finally:
+					# as Django does once a request is finished
+					close_old_connections()
+		finally:
+			connections.close_all()
+
+	def shutdown(self, wait=True):
+		with self.lock:
+			threads = list(self.threads)
+			for thread in threads:
+				self.work.put(None)
+		if wait:
+			for thread in threads:
+				thread.join()
+
+# pools shared by composite requests of the process, by their sizes
+compose_executors = {}
+compose_executors_lock = threading.Lock()
+
+def get_compose_executor(max_workers):
+	"""
+	Returns the pool of 'max_workers' threads which composite requests of
+	the process share, so they start no threads and connections of their own.
+	"""
+	with compose_executors_lock:
+		executor = compose_executors.get(max_workers)
+		if executor is None:
+			executor = compose_executors[max_workers] = \
+					ComposeExecutor(max_workers, daemon=True)
+		return executor
+
+def iter_requests(dispatcher, req_sigs, max_workers=1, meter=None):
+	"""
+	Makes every request as soon as its dependencies are done and yields
+	[key, response] pairs in the order requests are done. Requests are
+	made concurrently by the shared pool of 'max_workers' threads.
+	A response is released as soon as its dependents are done.
+	Requests are measured by the 'meter' if it is given.
+	"""
+	data = dict((key, compile_template(req_sig)) for key, req_sig in req_sigs)
+	graph = get_dependency_graph(data)
+	dependents = dict((key, []) for key in data)
+	for key, dependencies in graph.items():
+		for dependency in dependencies & set(data.keys()):
+			dependents[dependency].append(key)
+	waiting = dict((key, len(dependencies)) for key, dependencies in graph.items())
+	unread = dict((key, len(dependents[key])) for key in data)
+	ready = deque(key for key in data if waiting[key] == 0)
+	queued_at = dict((key, time.perf_counter()) for key in ready)
+
+	responses = {}
+	running = {}
+	done = set()
+	executor = get_compose_executor(max_workers) if max_workers > 1 else None
+	while ready or running:
+		completed = []
+		if executor is None:
+			key = ready.popleft()
+			completed.append((key, _make_measured_request \
+					(dispatcher, data[key], responses, meter, key, queued_at[key])))
+		else:
+			while ready and len(running) < max_workers:
+				key = ready.popleft()
+				future = executor.submit \
+						( _make_measured_request, dispatcher, data[key], responses
+						, meter, key, queued_at[key]
+						)
+				running[future] = key
+			finished, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in finished:
+				completed.append((running.pop(future), future.result()))
+
+		for key, response in completed:
+			done.add(key)
+			responses[key] = response
+			yield key, response
+			for dependent in dependents[key]:
+				waiting[dependent] -= 1
+				if waiting[dependent] == 0:
+					ready.append(dependent)
+					queued_at[dependent] = time.perf_counter()
+			for dependency in graph[key] & done:
+				unread[dependency] -= 1
+				if unread[dependency] == 0:
+					del responses[dependency]
+			if unread[key] == 0:
+				del responses[key]
+
+	# no progress can be made for the rest
+	for key in data:
+		if key not in done:
+			unmet_dependencies = graph[key] - set(data.keys())
+			if unmet_dependencies:
+				raise UnmetDependency([sorted(unmet_dependencies)[0]])
+	for key in data:
+		if key not in done:
+			raise CyclicDependency(key)
+
+def make_requests(dispatcher, req_sigs, max_workers=1, meter=None):
+	"""
+	Makes requests and returns their responses by keys.
+	"""
+	responses = dict(iter_requests(dispatcher, req_sigs, max_workers, meter))
+	return dict((key, responses[key]) for key, req_sig in req_sigs if key in responses)
+
+async def _make_async_request \
+		( loop, executor, semaphore, dispatcher, template, dependencies, responses
+		, timeout, meter, key
+		):
+	if dependencies:
+		await asyncio.gather(*dependencies)
+	for dependency in template.dependencies:
+		if responses.get(dependency) is None:
+			# dependency has failed, so the request is cancelled
+			return None
+
+	queued_at = time.perf_counter()
+	async with semaphore:
+		if executor is None:
+			# made by the thread of the composite request, in its transaction
+			return _make_measured_request \
+					(dispatcher, template, responses, meter, key, queued_at)
+		future = loop.run_in_executor \
+				( executor, _make_measured_request, dispatcher, template, responses
+				, meter, key, queued_at
 				)
+		try:
+			return await asyncio.wait_for(future, timeout)
+		except asyncio.TimeoutError:
+			return None
+
+async def _store_response(key, coroutine, responses):
+	# failures are timeouts and failed responses, other errors are raised
+	# as they are when requests are made synchronously
+	responses[key] = await coroutine
 
-		responses[key] = response.json() if response.status_code == 200 else None
+async def make_requests_async \
+		( dispatcher, req_sigs, max_workers=1, timeout=None, request_timeout=None
+		, meter=None
+		):
+	"""
+	Makes every request as soon as its dependencies are done. Requests
+	run on the shared pool of 'max_workers' threads, or on the calling
+	thread, one at a time, if 'max_workers' is 1. A request taking more
+	than 'request_timeout' seconds fails, and so do its dependents. When
+	'timeout' seconds are over, pending requests fail. Requests are
+	measured by the 'meter' if it is given.
+
+	Requests on the calling thread block it, so timeouts are only seen
+	between them. Threads can not be interrupted, so requests which are
+	running when they fail are left to finish in the background. Requests
+	which have not started yet never do, so at most 'max_workers' requests
+	are left running per call, on threads of the shared pool.
+	"""
+	loop = asyncio.get_event_loop()
+	data = dict((key, compile_template(req_sig)) for key, req_sig in req_sigs)
+	responses = {}
+	semaphore = asyncio.Semaphore(max(max_workers, 1))
+	executor = get_compose_executor(max_workers) if max_workers > 1 else None
+
+	tasks = {}
+	for level in get_dependency_levels(data):
+		for key in level:
+			template = data[key]
+			dependencies = \
+					[ tasks[dependency]
+					for dependency in template.dependencies
+					if dependency in tasks
+					]
+			coroutine = _make_async_request \
+					( loop, executor, semaphore, dispatcher, template
+					, dependencies, responses, request_timeout, meter, key
+					)
+			tasks[key] = asyncio.ensure_future \
+					(_store_response(key, coroutine, responses))
+
+	try:
+		await asyncio.wait_for(asyncio.gather(*tasks.values()), timeout)
+	except asyncio.TimeoutError:
+		pass
+	finally:
+		for task in tasks.values():
+			task.cancel()
+		await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+	return dict((key, responses.get(key)) for key in data.keys())
 
-	return make_requests(client, req_sigs, responses, pendings)
+def run_until_complete(coroutine):
+	"""
+	Runs the coroutine on a new event loop and returns its result.
+	"""
+	loop = asyncio.new_event_loop()
+	asyncio.set_event_loop(loop)
+	try:
+		return loop.run_until_complete(coroutine)
+	finally:
+		asyncio.set_event_loop(None)
+		loop.close()
 
 def make_nested_requests():
 	pass
@@ -0,0 +1,172 @@
+import hashlib
+from collections import OrderedDict
+
+from django.db.models.fields.related import ForeignObjectRel
+from django.urls import get_resolver
+from django_filters.utils import get_model_field
+
+from sane_api.apis import SaneModelAPI
+from sane_api.checks import get_routed_actions
+
+
+# kinds of indexes which lookups need
+BTREE = "btree"
+PATTERN = "pattern"
+UPPER_PATTERN = "upper_pattern"
+TRIGRAM = "trigram"
+UPPER_TRIGRAM = "upper_trigram"
+
+LOOKUP_KINDS = \
+		{ "exact": BTREE
+		, "in": BTREE
+		, "gt": BTREE
+		, "gte": BTREE
+		, "lt": BTREE
+		, "lte": BTREE
+		, "range": BTREE
+		, "isnull": BTREE
+		, "year": BTREE
+		, "month": BTREE
+		, "day": BTREE
+		, "date": BTREE
+		, "startswith": PATTERN
+		, "iexact": UPPER_PATTERN
+		, "istartswith": UPPER_PATTERN
+		, "contains": TRIGRAM
+		, "endswith": TRIGRAM
+		, "regex": TRIGRAM
+		, "icontains": UPPER_TRIGRAM
+		, "iendswith": UPPER_TRIGRAM
+		, "iregex": UPPER_TRIGRAM
+		}
+
+# PostgreSQL expressions of indexes which Index of Django 1.11 can not define
+SQL_TEMPLATES = \
+		{ PATTERN: 'CREATE INDEX "{name}" ON "{table}" ("{column}" varchar_pattern_ops);'
+		, UPPER_PATTERN: 'CREATE INDEX "{name}" ON "{table}" (UPPER("{column}") varchar_pattern_ops);'
+		, TRIGRAM: 'CREATE INDEX "{name}" ON "{table}" USING gin ("{column}" gin_trgm_ops);'
+		, UPPER_TRIGRAM: 'CREATE INDEX "{name}" ON "{table}" USING gin (UPPER("{column}") gin_trgm_ops);'
+		}
+
+
+class IndexSuggestion:
+	"""
+	An index of a model field which filters of apis need.
+	"""
+	def __init__(self, model, field, kind):
+		self.model = model
+		self.field = field
+		self.kind = kind
+		self.lookups = OrderedDict()
+
+	@property
+	def name(self):
+		table = self.model._meta.db_table
+		digest = hashlib.md5 \
+				("{}.{}.{}".format(table, self.field.column, self.kind).encode()).hexdigest()
+		return "{}_{}_{}_idx".format(table[:11], self.field.column[:7], digest[:6])
+
+	def add_lookup(self, lookup, view_class):
+		self.lookups.setdefault(lookup, []).append(view_class.__name__)
+
+	def as_operation(self):
+		"""
+		Returns a migration operation which creates the index.
+		"""
+		if self.kind == BTREE:
+			return \
+					( "migrations.AddIndex(\n"
+					"\tmodel_name={!r},\n"
+					"\tindex=models.Index(fields=[{!r}], name={!r}),\n"
+					")"
+					).format(self.model._meta.model_name, self.field.name, self.name)
+
+		sql = SQL_TEMPLATES[self.kind].format \
+				(name=self.name, table=self.model._meta.db_table, column=self.field.column)
+		if self.kind in (TRIGRAM, UPPER_TRIGRAM):
+			sql = "CREATE EXTENSION IF NOT EXISTS pg_trgm; " + sql
+		return \
+				( "migrations.RunSQL(\n"
+				"\t{!r},\n"
+				"\treverse_sql={!r},\n"
+				")"
+				).format(sql, 'DROP INDEX "{}";'.format(self.name))
+
+
+def get_filtered_views(patterns=None):
+	"""
+	Returns routed SaneModelAPI classes which have a filter class.
+	"""
+	if patterns is None:
+		patterns = get_resolver().url_patterns
+	views = OrderedDict()
+	for view_class, action in get_routed_actions(patterns):
+		if view_class is not None and issubclass(view_class, SaneModelAPI) \
+				and getattr(view_class, "filter_class", None) is not None:
+			views[view_class] = None
+	return list(views)
+
+def get_filterables(filter_class):
+	"""
+	Returns filterables of the filter class as lookups by field names. It
+	is read from an instance without request, as no request is at hand.
+	"""
+	filterset = filter_class.__new__(filter_class)
+	filterset.request = None
+	filterables = filterset.get_filterables()
+	if isinstance(filterables, dict):
+		return dict \
+				( (name, [lookups] if isinstance(lookups, str) else list(lookups))
+				for name, lookups in filterables.items()
+				)
+	if isinstance(filterables, str):
+		model = filter_class._meta.model
+		filterables = [field.name for field in model._meta.concrete_fields]
+	return dict((name, ["exact"]) for name in filterables)
+
+def is_indexed(model, field):
+	"""
+	Tells if the field leads an index of the model.
+	"""
+	if field.primary_key or field.unique or field.db_index:
+		return True
+	for index in model._meta.indexes:
+		if index.fields and index.fields[0].lstrip("-") == field.name:
+			return True
+	for fields in list(model._meta.index_together) + list(model._meta.unique_together):
+		if fields and fields[0] == field.name:
+			return True
+	return False
+
+def has_pattern_index(field):
+	"""
+	Tells if PostgreSQL has an index of the field for pattern lookups, as
+	Django creates one along with indexes of varchar and text fields.
+	"""
+	return field.db_index or field.unique
+
+def get_index_suggestions(views, existing_names=()):
+	"""
+	Returns indexes which filterables of the views need but models lack.
+	Indexes which are named in 'existing_names' are left out.
+	"""
+	suggestions = OrderedDict()
+	for view_class in views:
+		filter_class = view_class.filter_class
+		for name, lookups in get_filterables(filter_class).items():
+			field = get_model_field(filter_class._meta.model, name)
+			if field is None or isinstance(field, ForeignObjectRel):
+				continue
+			model = field.model
+			for lookup in lookups:
+				kind = LOOKUP_KINDS.get(lookup)
+				if kind is None \
+						or (kind == BTREE and is_indexed(model, field)) \
+						or (kind == PATTERN and has_pattern_index(field)):
+					continue
+				key = (model, field.name, kind)
+				if key not in suggestions:
+					suggestions[key] = IndexSuggestion(model, field, kind)
+				suggestions[key].add_lookup(lookup, view_class)
+	return [suggestion for suggestion in suggestions.values() \
+			if suggestion.name not in existing_names]
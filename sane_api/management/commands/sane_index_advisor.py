@@ -0,0 +1,99 @@
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.migrations.loader import MigrationLoader
+
+from sane_api.indexes import get_filtered_views, get_filterables, get_index_suggestions
+
+
+class Command(BaseCommand):
+	help = "Suggests indexes for filterables of routed SaneModelAPIs."
+
+	def add_arguments(self, parser):
+		parser.add_argument \
+				( "--database"
+				, default="default"
+				, help="Database whose existing indexes are left out."
+				)
+		parser.add_argument \
+				( "--migration"
+				, action="store_true"
+				, help="Prints suggestions as a migration per app."
+				)
+
+	def handle(self, *args, **options):
+		connection = connections[options["database"]]
+		suggestions = self.get_suggestions(get_filtered_views(), connection)
+		if not suggestions:
+			self.stdout.write("No index is missing.")
+			return
+
+		if connection.vendor != "postgresql":
+			self.stdout.write \
+					("# RunSQL operations are for PostgreSQL, while the database is {}.\n" \
+							.format(connection.vendor))
+
+		by_app = OrderedDict()
+		for suggestion in suggestions:
+			by_app.setdefault(suggestion.model._meta.app_label, []).append(suggestion)
+		for app_label, app_suggestions in by_app.items():
+			if options["migration"]:
+				self.stdout.write(self.format_migration(app_label, app_suggestions, connection))
+			else:
+				self.stdout.write(self.format_operations(app_suggestions))
+
+	def get_suggestions(self, views, connection):
+		checked_views = []
+		for view_class in views:
+			try:
+				get_filterables(view_class.filter_class)
+			except Exception as e:
+				self.stderr.write \
+						("Skipped {}, as its filterables need a request: {!r}" \
+								.format(view_class.__name__, e))
+			else:
+				checked_views.append(view_class)
+		return get_index_suggestions(checked_views, self.get_existing_names(connection))
+
+	def get_existing_names(self, connection):
+		"""
+		Returns names of indexes in the database, e.g. ones created by RunSQL.
+		"""
+		names = set()
+		with connection.cursor() as cursor:
+			for table in connection.introspection.table_names(cursor):
+				names.update(connection.introspection.get_constraints(cursor, table))
+		return names
+
+	def format_operations(self, suggestions):
+		lines = []
+		for suggestion in suggestions:
+			lines.append("# {}.{}: {}".format \
+					( suggestion.model._meta.label
+					, suggestion.field.name
+					, ", ".join \
+							( "{} ({})".format(lookup, ", ".join(views))
+							for lookup, views in suggestion.lookups.items()
+							)
+					))
+			lines.append(suggestion.as_operation() + ",")
+		return "\n".join(lines) + "\n"
+
+	def format_migration(self, app_label, suggestions, connection):
+		loader = MigrationLoader(connection, ignore_no_migrations=True)
+		leaves = loader.graph.leaf_nodes(app_label)
+		operations = self.format_operations(suggestions).strip().replace("\n", "\n\t\t")
+		return \
+				( "# {app_label}/migrations/xxxx_sane_indexes.py\n"
+				"from django.db import migrations, models\n\n\n"
+				"class Migration(migrations.Migration):\n"
+				"\tdependencies = {dependencies!r}\n\n"
+				"\toperations = [\n"
+				"\t\t{operations}\n"
+				"\t]\n"
+				).format \
+						( app_label=app_label
+						, dependencies=[list(leaf) for leaf in leaves]
+						, operations=operations
+						)
@@ -0,0 +1,173 @@
+import re
+import time
+import socket
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+
+
+class MetricsSink:
+	"""
+	Receives metrics in the manner of statsd. It discards them by default.
+	"""
+	def timing(self, name, value, tags=None):
+		pass
+
+	def incr(self, name, value=1, tags=None):
+		pass
+
+	def gauge(self, name, value, tags=None):
+		pass
+
+
+class InMemorySink(MetricsSink):
+	"""
+	Keeps metrics as [kind, name, value, tags] in memory, e.g. for tests.
+	"""
+	def __init__(self):
+		self.metrics = []
+		self.lock = threading.Lock()
+
+	def record(self, kind, name, value, tags):
+		with self.lock:
+			self.metrics.append([kind, name, value, tags or {}])
+
+	def timing(self, name, value, tags=None):
+		self.record("timing", name, value, tags)
+
+	def incr(self, name, value=1, tags=None):
+		self.record("incr", name, value, tags)
+
+	def gauge(self, name, value, tags=None):
+		self.record("gauge", name, value, tags)
+
+
+class StatsdSink(MetricsSink):
+	"""
+	Sends metrics to a statsd server over UDP, with tags in DogStatsD format.
+	"""
+	def __init__(self, host="localhost", port=8125, prefix="sane_api"):
+		self.address = (host, port)
+		self.prefix = prefix
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+	def send(self, name, value, kind, tags):
+		line = "{}.{}:{}|{}".format(self.prefix, name, value, kind)
+		if tags:
+			line += "|#" + ",".join("{}:{}".format(*tag) for tag in sorted(tags.items()))
+		try:
+			self.socket.sendto(line.encode(), self.address)
+		except OSError:
+			pass
+
+	def timing(self, name, value, tags=None):
+		self.send(name, value, "ms", tags)
+
+	def incr(self, name, value=1, tags=None):
+		self.send(name, value, "c", tags)
+
+	def gauge(self, name, value, tags=None):
+		self.send(name, value, "g", tags)
+
+
+@contextmanager
+def watch_queries(record):
+	"""
+	Adds count and time of database queries made within the block, by the
+	current thread, to the record.
+	"""
+	def execute(execute, sql, params, many, context):
+		start = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			record["db_queries"] += 1
+			record["db_time"] += (time.perf_counter() - start) * 1000
+
+	with ExitStack() as stack:
+		for alias in settings.DATABASES:
+			connection = connections[alias]
+			if hasattr(connection, "execute_wrapper"):
+				stack.enter_context(connection.execute_wrapper(execute))
+			else:
+				# Django < 2.0 has no execute wrapper, so debug cursor is used,
+				# which logs times of queries to the millisecond
+				stack.enter_context(_debug_cursor(connection, record))
+		yield
+
+@contextmanager
+def _debug_cursor(connection, record):
+	force_debug_cursor = connection.force_debug_cursor
+	connection.force_debug_cursor = True
+	start = len(connection.queries_log)
+	try:
+		yield
+	finally:
+		connection.force_debug_cursor = force_debug_cursor
+		queries = list(connection.queries_log)[start:]
+		record["db_queries"] += len(queries)
+		record["db_time"] += sum(float(query["time"]) for query in queries) * 1000
+
+
+class ComposeMeter:
+	"""
+	Records wall time, queue wait, database queries and cache usage of
+	every compose sub-request. Times are in milliseconds. Size of rendered
+	responses is recorded if 'measure_size' is True, as responses are
+	rendered once more to measure it.
+	"""
+	def __init__(self, measure_size=False):
+		self.measure_size = measure_size
+		self.records = OrderedDict()
+		self.local = threading.local()
+
+	def measure(self, key, queued_at, func, *args):
+		started_at = time.perf_counter()
+		record = self.records[key] = OrderedDict \
+				([ ("time", 0)
+				 , ("wait", (started_at - queued_at) * 1000 if queued_at else 0)
+				 , ("db_queries", 0)
+				 , ("db_time", 0)
+				 , ("size", None)
+				 , ("cache", None)
+				 ])
+		self.local.record = record
+		try:
+			with watch_queries(record):
+				result = func(*args)
+		finally:
+			self.local.record = None
+			record["time"] = (time.perf_counter() - started_at) * 1000
+		if self.measure_size:
+			record["size"] = len(JSONRenderer().render(result))
+		return result
+
+	def record_cache(self, hit):
+		record = getattr(self.local, "record", None)
+		if record is not None:
+			record["cache"] = "hit" if hit else "miss"
+
+	def server_timing(self):
+		"""
+		Returns value of 'Server-Timing' header.
+		"""
+		return ", ".join \
+				( "{};dur={:.3f}".format(re.sub(r"[^a-zA-Z0-9_\-]", "_", key), record["time"])
+				for key, record in self.records.items()
+				)
+
+	def flush(self, sink):
+		for key, record in self.records.items():
+			tags = {"key": key}
+			sink.timing("compose.time", record["time"], tags)
+			sink.timing("compose.wait", record["wait"], tags)
+			sink.timing("compose.db_time", record["db_time"], tags)
+			sink.incr("compose.db_queries", record["db_queries"], tags)
+			if record["size"] is not None:
+				sink.gauge("compose.size", record["size"], tags)
+			if record["cache"]:
+				sink.incr("compose.cache_{}".format(record["cache"]), 1, tags)
@@ -0,0 +1,193 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ValidationError
+from django.db import connections
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from sane_api.indexes import is_indexed
+
+
+class SaneKeysetPagination(BasePagination):
+	"""
+	Pages through a queryset by values of the last row of the previous page,
+	so deep pages cost as much as the first one. Rows are ordered by
+	'keyset_ordering' of the view, else by indexed fields leading ordering
+	of the model, and by pk to break ties. Ordering fields must not be null.
+
+	'count_mode' is None to skip counting, "exact" to count, or "estimate"
+	to use estimate of the query planner of PostgreSQL.
+	"""
+	page_size = api_settings.PAGE_SIZE or 100
+	page_size_query_param = "page_size"
+	max_page_size = 1000
+	cursor_query_param = "cursor"
+	count_mode = None
+	invalid_cursor_message = "Invalid cursor."
+
+	def paginate_queryset(self, queryset, request, view=None):
+		self.request = request
+		self.page_size = self.get_page_size(request)
+		self.ordering = self.get_ordering(queryset, view)
+		self.count = self.get_count(queryset)
+
+		queryset = self.load_ordering_fields(queryset.order_by(*self.ordering))
+		cursor = self.decode_cursor(request, queryset.model)
+		if cursor is not None:
+			queryset = queryset.filter(self.get_keyset_q(cursor))
+
+		rows = list(queryset[:self.page_size + 1])
+		page = rows[:self.page_size]
+		self.next_cursor = None
+		if len(rows) > self.page_size:
+			self.next_cursor = self.encode_cursor(page[-1], queryset.model)
+		return page
+
+	def get_paginated_response(self, data):
+		response = OrderedDict()
+		if self.count_mode is not None:
+			response["count"] = self.count
+		response["next"] = self.get_next_link()
+		response["next_cursor"] = self.next_cursor
+		response["results"] = data
+		return Response(response)
+
+	def get_page_size(self, request):
+		if self.page_size_query_param:
+			try:
+				return _positive_int \
+						( request.query_params[self.page_size_query_param]
+						, strict=True
+						, cutoff=self.max_page_size
+						)
+			except (KeyError, ValueError):
+				pass
+		return self.page_size
+
+	def get_ordering(self, queryset, view):
+		"""
+		Returns ordering by stable and indexed fields, ending with pk.
+		Nullable fields of 'keyset_ordering' are rejected, as rows with null
+		can not be compared with a cursor.
+		"""
+		model = queryset.model
+		pk_name = model._meta.pk.name
+		ordering = getattr(view, "keyset_ordering", None)
+		if ordering is None:
+			ordering = []
+			for name in model._meta.ordering:
+				if not isinstance(name, str) or name.lstrip("-") in ("?", "pk", pk_name) \
+						or LOOKUP_SEP in name:
+					# fields of related models are not read by cursors
+					break
+				field = model._meta.get_field(name.lstrip("-"))
+				if field.null or not is_indexed(model, field):
+					break
+				ordering.append(name)
+		else:
+			for name in ordering:
+				field_name = name.lstrip("-")
+				if field_name == "pk":
+					continue
+				try:
+					field = model._meta.get_field(field_name)
+				except FieldDoesNotExist:
+					raise ImproperlyConfigured \
+							( "Keyset ordering of '{}' by '{}', which is not its field."
+							.format(model.__name__, field_name)
+							)
+				if field.null:
+					raise ImproperlyConfigured \
+							( "Keyset ordering of '{}' by nullable field '{}'."
+							.format(model.__name__, field_name)
+							)
+
+		ordering = list(ordering)
+		if not any(name.lstrip("-") in ("pk", pk_name) for name in ordering):
+			descending = ordering[-1].startswith("-") if ordering else True
+			ordering.append("-pk" if descending else "pk")
+		return ordering
+
+	def load_ordering_fields(self, queryset):
+		"""
+		Adds ordering fields to fields loaded by only(), as cursor reads them.
+		"""
+		only_fields, is_deferred = queryset.query.deferred_loading
+		if is_deferred or not only_fields:
+			return queryset
+		names = set(name.lstrip("-") for name in self.ordering)
+		return queryset.only(*(set(only_fields) | names))
+
+	def get_keyset_q(self, cursor):
+		"""
+		Returns condition of rows after the cursor in the ordering.
+		"""
+		keyset_q = Q()
+		equal_q = Q()
+		for name, value in zip(self.ordering, cursor):
+			field_name = name.lstrip("-")
+			lookup = "lt" if name.startswith("-") else "gt"
+			keyset_q |= equal_q & Q(**{"{}__{}".format(field_name, lookup): value})
+			equal_q &= Q(**{field_name: value})
+		return keyset_q
+
+	def get_count(self, queryset):
+		if self.count_mode is None:
+			return None
+		queryset = queryset.order_by()
+		if self.count_mode == "estimate":
+			connection = connections[queryset.db]
+			if connection.vendor == "postgresql":
+				return self.estimate_count(queryset, connection)
+		return queryset.count()
+
+	def estimate_count(self, queryset, connection):
+		sql, params = queryset.query.sql_with_params()
+		with connection.cursor() as cursor:
+			cursor.execute("EXPLAIN (FORMAT JSON) {}".format(sql), params)
+			plan = cursor.fetchone()[0]
+		if isinstance(plan, str):
+			plan = json.loads(plan)
+		return int(plan[0]["Plan"]["Plan Rows"])
+
+	def get_next_link(self):
+		if self.next_cursor is None:
+			return None
+		url = self.request.build_absolute_uri()
+		return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+	def encode_cursor(self, obj, model):
+		# values are kept as strings of their fields, which keep microseconds
+		# of datetimes, and are read back by to_python() of the fields
+		values = []
+		for name in self.ordering:
+			field_name = name.lstrip("-")
+			field = model._meta.pk if field_name == "pk" else model._meta.get_field(field_name)
+			values.append(field.value_to_string(obj))
+		data = json.dumps(values).encode()
+		return urlsafe_b64encode(data).decode().rstrip("=")
+
+	def decode_cursor(self, request, model):
+		encoded = request.query_params.get(self.cursor_query_param)
+		if not encoded:
+			return None
+		try:
+			data = urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+			values = json.loads(data.decode())
+			if not isinstance(values, list) or len(values) != len(self.ordering):
+				raise ValueError()
+			cursor = []
+			for name, value in zip(self.ordering, values):
+				field_name = name.lstrip("-")
+				field = model._meta.pk if field_name == "pk" else model._meta.get_field(field_name)
+				cursor.append(field.to_python(value))
+			return cursor
+		except (TypeError, ValueError, ValidationError):
+			raise NotFound(self.invalid_cursor_message)
@@ -0,0 +1,14 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class NDJSONRenderer(JSONRenderer):
+	"""
+	Renders data as a line of newline delimited JSON.
+	"""
+	media_type = "application/x-ndjson"
+	format = "ndjson"
+
+	def render(self, data, accepted_media_type=None, renderer_context=None):
+		rendered = super(NDJSONRenderer, self).render \
+				(data, accepted_media_type, renderer_context)
+		return rendered + b"\n"
@@ -1,6 +1,8 @@
-import re
+import copy
 from functools import partial
 import json
+import threading
+from collections import OrderedDict
 
 from django.db import models
 from rest_framework.serializers import \
@@ -11,20 +13,36 @@ from rest_framework.serializers import \
 		, Field
 		, CharField
 		, JSONField
+		, BooleanField
+		, IntegerField
+		, FloatField
+		, PrimaryKeyRelatedField
 		)
+from rest_framework.utils.serializer_helpers import BindingDict
 
 class PermissionField(Field):
+	"""
+	Lists actions which the user is authorized for on the object. A model
+	may authorize objects in bulk with a 'can_many(objs, user, request)'
+	classmethod which returns permissions by pks of the objects.
+	"""
+	# authorizer and permission names by model class
+	authorizers = {}
+
 	def __init__(self, *args, **kwargs):
 		kwargs["read_only"] = True
 		super(PermissionField, self).__init__(*args, **kwargs)
+		self.bulk_permissions = {}
 
 	def to_representation(self, obj):
+		permissions = self.bulk_permissions.get(obj.pk)
+		if permissions is not None:
+			return permissions
+
 		request = self.context["request"]
-		permission_methods = filter(lambda method: re.match("can_", method), dir(obj))
 		permissions = []
-		for permission_method in permission_methods:
-			permission_name = permission_method.replace("can_", "")
-			authorizer = getattr(obj, permission_method)
+		for authorizer_name, permission_name in self.get_authorizers(type(obj)):
+			authorizer = getattr(obj, authorizer_name)
 			if authorizer(request.user, request):
 				permissions.append(permission_name)
 		return permissions
@@ -32,22 +50,159 @@ class PermissionField(Field):
 	def get_attribute(self, instance):
 		return instance
 
+	def get_authorizers(self, model):
+		authorizers = self.authorizers.get(model)
+		if authorizers is None:
+			authorizers = self.authorizers[model] = tuple \
+					( (name, name[len("can_"):])
+					for name in dir(model)
+					if name.startswith("can_") and name != "can_many"
+					)
+		return authorizers
+
+	def authorize_many(self, objs):
+		"""
+		Authorizes the objects at once if their model has 'can_many'.
+		"""
+		self.bulk_permissions = {}
+		if not objs or not hasattr(type(objs[0]), "can_many"):
+			return
+		request = self.context["request"]
+		permissions = type(objs[0]).can_many(objs, request.user, request)
+		self.bulk_permissions = dict \
+				( (pk, sorted(permission_names))
+				for pk, permission_names in permissions.items()
+				)
+
+class SaneListSerializer(ListSerializer):
+	"""
+	Lets permission fields of the child authorize all of the objects at once.
+	"""
+	def to_representation(self, data):
+		objs = list(data.all() if isinstance(data, models.Manager) else data)
+		for field in self.child.fields.values():
+			if isinstance(field, PermissionField):
+				field.authorize_many(objs)
+		return super(SaneListSerializer, self).to_representation(objs)
+
+class FieldPlanCache:
+	"""
+	LRU cache of final fields of serializers by serializer class, request
+	method, access profile and requested fields. Fields of a serializer
+	class are built once and copied for its instances.
+	"""
+	def __init__(self, maxsize=1024):
+		self.maxsize = maxsize
+		self.plans = OrderedDict()
+		self.prototypes = {}
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			plan = self.plans.get(key)
+			if plan is not None:
+				self.plans.move_to_end(key)
+			return plan
+
+	def set(self, key, plan):
+		with self.lock:
+			self.plans[key] = plan
+			while len(self.plans) > self.maxsize:
+				self.plans.popitem(last=False)
+
+	def get_prototypes(self, serializer):
+		serializer_class = type(serializer)
+		prototypes = self.prototypes.get(serializer_class)
+		if prototypes is None:
+			prototypes = self.prototypes[serializer_class] = serializer.get_fields()
+		return prototypes
+
+	def clear(self):
+		with self.lock:
+			self.plans.clear()
+			self.prototypes.clear()
+
+field_plans = FieldPlanCache()
+
 class SaneSerializerMixin:
+	field_plans = field_plans
+	requested_fields = None
+	_empty_data = None
+
 	def __init__(self, *args, **kwargs):
 		super(SaneSerializerMixin, self).__init__(*args, **kwargs)
 		if not hasattr(self, "context") or not self.context.get("request"):
 			return
 
-		request = self.context.get("request")
-		available_fields = set(self.fields.keys())
-		accessible_fields = self.get_accessible_fields()
-		requested_fields = self.get_requested_fields()
+		# plans of the request by serializer classes, if the view keeps them
+		request_plans = self.context.get("field_plans")
+		plan = None if request_plans is None else request_plans.get(type(self))
+		plan_key = None if plan is not None else self.get_field_plan_key()
+		if plan_key is not None:
+			plan = self.field_plans.get(plan_key)
+		if plan is None:
+			plan = self.get_field_plan()
+			if plan_key is not None:
+				self.field_plans.set(plan_key, plan)
+			self.set_fields(plan[0])
+		else:
+			self.set_fields(plan[0], self.field_plans.get_prototypes(self))
+		if request_plans is not None:
+			request_plans[type(self)] = plan
+
+		self.final_fields = set(plan[0])
+		self.requested_fields = plan[1]
 
-		field_groups = [available_fields, accessible_fields, requested_fields]
-		self.final_fields = set.intersection(*field_groups)
+	def get_field_plan_key(self):
+		"""
+		Returns key of the cached final fields, or None if they are not
+		cached, i.e. if the serializer has no access profile.
+		"""
+		access_profile_key = self.get_access_profile_key()
+		if access_profile_key is None:
+			return None
+		request = self.context["request"]
+		return \
+				( type(self)
+				, request.method.lower()
+				, access_profile_key
+				, request.query_params.get("fields")
+				)
 
-		for field in available_fields - self.final_fields:
-			self.fields.pop(field)
+	def get_access_profile_key(self):
+		"""
+		Override it to cache fields of the serializer. It should return a
+		hashable key, e.g. group of the user, which is same for users having
+		same accessible fields.
+		"""
+		return None
+
+	def get_field_plan(self):
+		"""
+		Returns final fields in order of available fields, and requested fields.
+		"""
+		available_fields = list(self.fields.keys())
+		accessible_fields = set(self.get_accessible_fields())
+		requested_fields = self.get_requested_fields(accessible_fields)
+		final_fields = tuple \
+				( field
+				for field in available_fields
+				if field in accessible_fields and field in requested_fields
+				)
+		return (final_fields, tuple(OrderedDict.fromkeys(requested_fields)))
+
+	def set_fields(self, final_fields, prototypes=None):
+		"""
+		Keeps only the final fields, copying them from prototypes if given.
+		"""
+		if prototypes is None:
+			for field in set(self.fields.keys()) - set(final_fields):
+				self.fields.pop(field)
+			return
+
+		self._fields = BindingDict(self)
+		for field in final_fields:
+			self._fields[field] = copy.deepcopy(prototypes[field])
 
 	def get_accessible_fields(self):
 		request_method = self.context["request"].method.lower()
@@ -56,10 +211,11 @@ class SaneSerializerMixin:
 		else:
 			return set(self.get_writable_fields())
 
-	def get_requested_fields(self):
+	def get_requested_fields(self, accessible_fields=None):
 		fields_str = self.context["request"].query_params.get("fields")
-		accessible_fields = self.get_accessible_fields()
 		if not fields_str:
+			if accessible_fields is None:
+				accessible_fields = self.get_accessible_fields()
 			return accessible_fields
 		return fields_str.split(",")
 
@@ -70,14 +226,40 @@ class SaneSerializerMixin:
 		"""
 		data = super(SaneSerializerMixin, self).to_representation(obj)
 
-		if not hasattr(self, "context") or not self.context.get("request"):
+		empty_data = self.get_empty_data()
+		if empty_data is None:
 			return data
 
-		empty_fields = set.difference(set(self.get_requested_fields()), set(data.keys()))
-		for field in empty_fields:
-			data[field] = None
+		data.update(empty_data)
+		if len(data) < len(self.requested_fields):
+			# some fields were skipped for the object
+			for field in self.requested_fields:
+				data.setdefault(field, None)
 		return data
 
+	def get_empty_data(self):
+		"""
+		Returns None for requested fields which are not readable. It is
+		computed once per serializer, i.e. once for every object of a list.
+		"""
+		if self._empty_data is None:
+			if not hasattr(self, "context") or not self.context.get("request"):
+				return None
+			if self.requested_fields is None:
+				self.requested_fields = \
+						tuple(OrderedDict.fromkeys(self.get_requested_fields()))
+			readable_fields = set \
+					( name
+					for name, field in self.fields.items()
+					if not field.write_only
+					)
+			self._empty_data = OrderedDict \
+					( (field, None)
+					for field in self.requested_fields
+					if field not in readable_fields
+					)
+		return self._empty_data
+
 	def get_readable_fields(self):
 		raise Exception \
 				("Please implement this method and so that it returns different fields for different user/group.")
@@ -89,9 +271,107 @@ class SaneSerializerMixin:
 class SaneSerializer(SaneSerializerMixin, Serializer):
 	pass
 
+def _convert_nullable(convert):
+	return lambda value: None if value is None else convert(value)
+
 class SaneModelSerializer(SaneSerializerMixin, ModelSerializer):
 	permissions = PermissionField()
+	# fields whose representation is the value read from database
+	plain_field_classes = (IntegerField, CharField, BooleanField, FloatField)
+	# model fields whose instances hold the value read from database as it is,
+	# unlike e.g. FileField whose descriptor wraps it
+	column_model_field_classes = \
+			( models.AutoField
+			, models.IntegerField
+			, models.FloatField
+			, models.DecimalField
+			, models.BooleanField
+			, models.NullBooleanField
+			, models.CharField
+			, models.TextField
+			, models.DateField
+			, models.TimeField
+			, models.DurationField
+			, models.UUIDField
+			, models.GenericIPAddressField
+			)
+
+	@classmethod
+	def many_init(cls, *args, **kwargs):
+		list_serializer = super(SaneModelSerializer, cls).many_init(*args, **kwargs)
+		if type(list_serializer) is ListSerializer:
+			# unless Meta has a list serializer class
+			list_serializer.__class__ = SaneListSerializer
+		return list_serializer
+
+	def get_columns(self):
+		"""
+		Returns [field name, column, converter] of final fields if all of
+		them read model columns of 'column_model_field_classes' as they
+		are, else returns None. It is None
+		as well if the serializer represents objects or lists its own way.
+		"""
+		if getattr(self, "final_fields", None) is None:
+			return None
+		if type(self).to_representation is not SaneSerializerMixin.to_representation \
+				or getattr(self.Meta, "list_serializer_class", None) is not None:
+			return None
+
+		model = self.Meta.model
+		concrete_fields = dict \
+				( (field.name, field)
+				for field in model._meta.concrete_fields
+				)
+		columns = []
+		for name, field in self.fields.items():
+			if field.write_only:
+				continue
+			model_field = concrete_fields.get(field.source)
+			if model_field is None:
+				return None
+
+			if isinstance(field, PrimaryKeyRelatedField) and model_field.is_relation:
+				convert = field.pk_field.to_representation if field.pk_field else None
+			elif model_field.is_relation \
+					or not isinstance(model_field, self.column_model_field_classes):
+				return None
+			elif type(field) in self.plain_field_classes:
+				convert = None
+			elif type(field).get_attribute is not Field.get_attribute:
+				# the field reads the object itself
+				return None
+			else:
+				convert = field.to_representation
+			convert = convert and _convert_nullable(convert)
+			columns.append((name, model_field.attname, convert))
+		return columns
+
+	def represent_rows(self, rows, columns):
+		"""
+		Returns representations of rows of values of the columns, the way
+		to_representation() does for objects.
+		"""
+		names = [name for name, column, convert in columns]
+		converters = \
+				[ (i, convert)
+				for i, (name, column, convert) in enumerate(columns)
+				if convert is not None
+				]
+		empty_data = self.get_empty_data() or {}
+
+		data = []
+		for row in rows:
+			if converters:
+				row = list(row)
+				for i, convert in converters:
+					row[i] = convert(row[i])
+			item = OrderedDict(zip(names, row))
+			item.update(empty_data)
+			data.append(item)
+		return data
 
 class CompositeRequestSerializer(Serializer):
 	url = CharField()
 	query = JSONField(required=False)
+	batch = BooleanField(required=False)
+	batch_size = IntegerField(required=False, min_value=1)
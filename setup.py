@@ -20,7 +20,7 @@ kwargs =  {
   "url": "https://github.com/janakitech/sane-api",
   "license": read_file("license.txt"),
   "keywords": "api rest django drf safe scalable",
-  "packages": find_packages(exclude=["tests"]),
+  "packages": find_packages(exclude=["tests", "benchmarks"]),
   "install_requires": json.loads(read_file("project.json"))["dependencies"],
 }
 
@@ -1,15 +1,23 @@
+import json
 from unittest.mock import patch
 
 from django.test import TestCase
-from django.db import models
+from django.db import models, connection
+from django.contrib.auth.models import User
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.viewsets import ViewSet
 from rest_framework.decorators import detail_route, list_route
 
-from sane_api.apis import SaneAPIMixin, SaneAPI, SaneModelAPI, HelperAPI
+from sane_api.apis import \
+		SaneAPIMixin, SaneAPI, SaneModelAPI, HelperAPI, SanePermissionClass
+from sane_api.metrics import InMemorySink
+from sane_api.serializers import SaneModelSerializer
+from tests.models import Article, Attachment, Comment
 
 factory = APIRequestFactory()
 
@@ -64,6 +72,26 @@ class TestSaneAPI(TestCase):
 		assert response.status_code == 403, \
 			"It disallows, if an authorize at api is absent."
 
+class TestSanePermissionClass(TestCase):
+	def test1(self):
+		request = factory.post('/', '', content_type='application/json')
+		aview = ASaneAPI.as_view(actions= {'post': 'create', })
+		aview(request)
+		assert SanePermissionClass.authorizer_names[(ASaneAPI, "create")] == "can_create", \
+			"It caches names of authorizers."
+
+		with patch.object(ASaneAPI, "can_create") as can_create:
+			can_create.return_value = False
+			response = aview(request)
+		assert response.status_code == 403, "It uses patched authorizers."
+
+	def test2(self):
+		request = factory.get('/', '', content_type='application/json')
+		aview = ASaneAPI.as_view(actions= {'get': 'list', })
+		aview(request)
+		assert SanePermissionClass.authorizer_names[(ASaneAPI, "list")] == None, \
+			"It caches absent authorizers."
+
 class AModel(models.Model):
 	name = models.CharField(max_length=20)
 
@@ -144,6 +172,273 @@ class TestSaneModelAPI(TestCase):
 		except Exception as e:
 			pass
 
+class ArticleSerializer(SaneModelSerializer):
+	def get_readable_fields(self):
+		return ["id", "title", "body", "user", "created_on", "permissions"]
+
+	class Meta:
+		model = Article
+		fields = "__all__"
+
+class ArticleAPI(SaneModelAPI):
+	queryset = Article.objects.all()
+	serializer_class = ArticleSerializer
+
+	def get_queryset(self):
+		return self.queryset.all()
+
+	def can_list(self, user, request):
+		return True
+
+class TestSaneModelAPIQueryset(TestCase):
+	def setUp(self):
+		user = User.objects.create(username="ram")
+		Article.objects.create(title="article1", body="body1", user=user)
+
+	def list(self, fields):
+		request = factory.get('/', {"fields": fields})
+		aview = ArticleAPI.as_view(actions= {'get': 'list', })
+		with CaptureQueriesContext(connection) as context:
+			response = aview(request)
+		return response, context.captured_queries[0]["sql"]
+
+	def test1(self):
+		response, sql = self.list("id,title,user")
+		assert response.data == [{"id": 1, "title": "article1", "user": 1}]
+		assert "body" not in sql, "It fetches only the requested fields."
+
+	def test2(self):
+		response, sql = self.list("title,permissions")
+		assert "body" in sql, \
+			"It fetches all the fields if a requested field reads the object."
+
+class UserSerializer(SaneModelSerializer):
+	def get_readable_fields(self):
+		return ["id", "username"]
+
+	class Meta:
+		model = User
+		fields = ("id", "username")
+
+class CommentSerializer(SaneModelSerializer):
+	user = UserSerializer()
+
+	def get_readable_fields(self):
+		return ["id", "content", "user"]
+
+	class Meta:
+		model = Comment
+		fields = ("id", "content", "user")
+
+class NestedArticleSerializer(SaneModelSerializer):
+	user = UserSerializer()
+	comments = CommentSerializer(many=True)
+
+	def get_readable_fields(self):
+		return ["id", "title", "user", "comments"]
+
+	class Meta:
+		model = Article
+		fields = ("id", "title", "user", "comments")
+
+class NestedArticleAPI(ArticleAPI):
+	serializer_class = NestedArticleSerializer
+
+class TestSaneModelAPIRelated(TestCase):
+	def create_articles(self, count):
+		for i in range(User.objects.count(), User.objects.count() + count):
+			user = User.objects.create(username="user{}".format(i))
+			article = Article.objects.create(title="article", body="body", user=user)
+			for j in range(2):
+				Comment.objects.create(content="comment", article=article, user=user)
+
+	def list(self, fields=None):
+		request = factory.get('/', {"fields": fields} if fields else {})
+		aview = NestedArticleAPI.as_view(actions= {'get': 'list', })
+		with CaptureQueriesContext(connection) as context:
+			response = aview(request)
+		return response, len(context.captured_queries)
+
+	def test1(self):
+		self.create_articles(1)
+		response, count = self.list()
+		assert response.data[0]["comments"][0]["user"]["username"] == "user0"
+
+		self.create_articles(5)
+		response, more_count = self.list()
+		assert len(response.data) == 6
+		assert count == more_count == 2, \
+			"It makes constant number of queries for lists of any size."
+
+	def test2(self):
+		self.create_articles(3)
+		response, count = self.list("id,title,user")
+		assert response.data[0]["user"] == {"id": 1, "username": "user0"}
+		assert count == 1, "It selects related objects of requested fields only."
+
+class CommentAPI(SaneModelAPI):
+	queryset = Comment.objects.all()
+	serializer_class = CommentSerializer
+	pagination_class = LimitOffsetPagination
+
+	def get_queryset(self):
+		return self.queryset.all()
+
+	def can_list(self, user, request):
+		return True
+
+	def can_retrieve(self, user, request):
+		return True
+
+class TestSaneModelAPIAuthorized(TestCase):
+	def setUp(self):
+		self.ram = User.objects.create(username="ram")
+		hari = User.objects.create(username="hari")
+		article = Article.objects.create(title="article", body="body", user=hari)
+		for user in [self.ram, hari, hari]:
+			Comment.objects.create(content=user.username, article=article, user=user)
+
+	def test1(self):
+		request = factory.get('/', {"limit": 10})
+		force_authenticate(request, self.ram)
+		aview = CommentAPI.as_view(actions= {'get': 'list', })
+		response = aview(request)
+		assert response.data["count"] == 1 \
+				and response.data["results"][0]["content"] == "ram", \
+			"It lists objects which 'permission_q' of the model allows."
+
+	def test2(self):
+		request = factory.get('/')
+		force_authenticate(request, self.ram)
+		aview = CommentAPI.as_view(actions= {'get': 'retrieve', })
+		response = aview(request, pk=Comment.objects.last().pk)
+		assert response.status_code == 200, \
+			"It does not filter single objects by 'permission_q'."
+
+class CommentListAPI(SaneModelAPI):
+	queryset = Comment.objects.all()
+	serializer_class = CommentSerializer
+
+	def get_queryset(self):
+		return self.queryset.all()
+
+	def can_list(self, user, request):
+		return True
+
+	def can_retrieve(self, user, request):
+		return True
+
+	@list_route(methods=["get"])
+	def pair(self, request):
+		first, second = self.get_queryset().order_by("pk")[:2]
+		return Response([self.get_serializer(first).data, self.get_serializer(second).data])
+
+	def can_pair(self, user, request):
+		return True
+
+class TestSaneModelAPISerializer(TestCase):
+	def setUp(self):
+		self.user = User.objects.create(username="ram")
+		article = Article.objects.create(title="article1", body="body1", user=self.user)
+		self.comment = Comment.objects.create(content="comment1", article=article, user=self.user)
+
+	def get(self, action, **kwargs):
+		request = factory.get('/', {"fields": "id,content"})
+		force_authenticate(request, self.user)
+		aview = CommentListAPI.as_view(actions= {'get': action, })
+		with patch.object(CommentSerializer, "get_field_plan", autospec=True, \
+				side_effect=CommentSerializer.get_field_plan) as get_field_plan:
+			with CaptureQueriesContext(connection) as context:
+				response = aview(request, **kwargs)
+		return response, get_field_plan.call_count, context.captured_queries
+
+	def test1(self):
+		response, plans, queries = self.get("list")
+		assert response.data == [{"id": self.comment.pk, "content": "comment1"}]
+		assert plans == 1, "It plans fields once per list request."
+
+	def test2(self):
+		response, plans, queries = self.get("retrieve", pk=self.comment.pk)
+		assert response.data == {"id": self.comment.pk, "content": "comment1"}
+		assert plans == 1, "It plans fields once per retrieve request."
+		assert "article_id" in queries[0]["sql"], \
+				"It fetches all the fields of single objects."
+
+	def test3(self):
+		other = Comment.objects.create \
+				(content="comment2", article=self.comment.article, user=self.user)
+		response, plans, queries = self.get("pair")
+		assert [comment["id"] for comment in response.data] == [self.comment.pk, other.pk], \
+				"It builds a new serializer for every object."
+
+class ColumnarArticleAPI(ArticleAPI):
+	columnar_list = True
+
+class AttachmentSerializer(SaneModelSerializer):
+	def get_readable_fields(self):
+		return ["id", "name", "file"]
+
+	class Meta:
+		model = Attachment
+		fields = ("id", "name", "file")
+
+class AttachmentAPI(SaneModelAPI):
+	queryset = Attachment.objects.all()
+	serializer_class = AttachmentSerializer
+	columnar_list = True
+
+	def get_queryset(self):
+		return self.queryset.all()
+
+	def can_list(self, user, request):
+		return True
+
+class TestSaneModelAPIColumnar(TestCase):
+	def setUp(self):
+		user = User.objects.create(username="ram")
+		for i in range(3):
+			Article.objects.create(title="article{}".format(i), body="body", user=user)
+
+	def list(self, api, fields):
+		request = factory.get('/', {"fields": fields})
+		aview = api.as_view(actions= {'get': 'list', })
+		return aview(request).data
+
+	def test1(self):
+		fields = "id,title,user,created_on,missing"
+		with patch.object(Article, "from_db") as from_db:
+			data = self.list(ColumnarArticleAPI, fields)
+		assert not from_db.called, "It does not instantiate models."
+		assert data == self.list(ArticleAPI, fields), \
+			"It serializes rows same as objects."
+		assert list(data[0]) == ["id", "title", "created_on", "user", "missing"]
+
+	def test2(self):
+		with patch.object(Article, "from_db", wraps=Article.from_db) as from_db:
+			data = self.list(ColumnarArticleAPI, "id,permissions")
+		assert from_db.called, "It serializes objects if a field reads the object."
+
+	def test3(self):
+		class TitledArticleSerializer(ArticleSerializer):
+			def to_representation(self, obj):
+				data = super(TitledArticleSerializer, self).to_representation(obj)
+				data["title"] = data["title"].upper()
+				return data
+
+		class TitledArticleAPI(ColumnarArticleAPI):
+			serializer_class = TitledArticleSerializer
+
+		data = self.list(TitledArticleAPI, "id,title")
+		assert [article["title"] for article in data] == ["ARTICLE0", "ARTICLE1", "ARTICLE2"], \
+				"It serializes objects if the serializer overrides to_representation()."
+
+	def test4(self):
+		Attachment.objects.create(name="attachment", file="x/file.txt")
+		with patch.object(Attachment, "from_db", wraps=Attachment.from_db) as from_db:
+			data = self.list(AttachmentAPI, "id,file")
+		assert from_db.called and data[0]["file"].endswith("/x/file.txt"), \
+				"It serializes objects if a model field wraps its value, e.g. a file."
+
 class TestSaneAPITester:
 	def test1(self):
 		assert 0, "It warns about apis which do not implement Sane api."
@@ -221,8 +516,10 @@ class TestHelperAPI(APITestCase):
 		urlpatterns.extend(router.urls)
 
 	def tearDown(self):
+		from django.urls import clear_url_caches
 		from tests.urls import urlpatterns
 		del urlpatterns[:]
+		clear_url_caches()
 
 	def test_compose1(self):
 		from django.core.urlresolvers import reverse
@@ -338,3 +635,196 @@ class TestHelperAPI(APITestCase):
 				"It complains if a url has unmet dependecy at sub level."
 		assert "user.nokey" in response.json()["detail"]
 
+	@patch.object(HelperAPI, "compose_async", True)
+	def test_compose6(self):
+		from django.core.urlresolvers import reverse
+
+		payload = \
+				{ "user": {"url": "/blog/user/", "query": {"id": 1}}
+				, "article": \
+						{ "url": "/blog/article/"
+						, "query": {"user": "{user.id}"}
+						}
+				}
+		url = reverse("helper-compose")
+		response = self.client.post(url, payload, format="json")
+
+		expected = \
+				{ "user": [
+						{ "id": 1 , "name": "user1" }
+					]
+				, "article": [
+						{ "id": 1, "user": 1, "title": "article1"},
+						{ "id": 2, "user": 1, "title": "article2"},
+					]
+				}
+		assert response.json() == expected, "It composes on an event loop."
+
+	def test_compose7(self):
+		from django.core.urlresolvers import reverse
+
+		payload = \
+				{ "user": {"url": "/blog/user/", "query": {"id": 1}}
+				, "article": \
+						{ "url": "/blog/article/"
+						, "query": {"user": "{user.id}"}
+						}
+				}
+		url = reverse("helper-compose")
+		response = self.client.post \
+				(url, payload, format="json", HTTP_ACCEPT="application/x-ndjson")
+
+		assert response.streaming, "It streams responses if ndjson is accepted."
+		lines = b"".join(response.streaming_content).decode().splitlines()
+		expected = \
+				[ {"user": [{ "id": 1 , "name": "user1" }]}
+				, {"article": \
+						[ { "id": 1, "user": 1, "title": "article1"}
+						, { "id": 2, "user": 1, "title": "article2"}
+						]}
+				]
+		assert [json.loads(line) for line in lines] == expected, \
+				"It streams a line for every response."
+
+	@patch.object(HelperAPI, "compose_batch_size", 1)
+	def test_compose8(self):
+		from django.core.urlresolvers import reverse
+
+		payload = \
+				{ "user": {"url": "/blog/user/"}
+				, "article": \
+						{ "url": "/blog/article/"
+						, "query": {"user": "{user.id}"}
+						, "batch": True
+						}
+				}
+		url = reverse("helper-compose")
+		response = self.client.post(url, payload, format="json")
+
+		expected = \
+				[ { "id": 1, "user": 1, "title": "article1"}
+				, { "id": 2, "user": 1, "title": "article2"}
+				, { "id": 3, "user": 2, "title": "article3"}
+				]
+		assert response.json()["article"] == expected, \
+				"It batches list valued dependencies."
+
+	@patch.object(HelperAPI, "compose_batch_size", 1)
+	@patch.object(HelperAPI, "compose_max_fanout", 2)
+	def test_compose9(self):
+		from django.core.urlresolvers import reverse
+
+		payload = \
+				{ "user": {"url": "/blog/user/"}
+				, "article": \
+						{ "url": "/blog/article/"
+						, "query": {"user": "{user.id}"}
+						, "batch": True
+						}
+				}
+		url = reverse("helper-compose")
+		response = self.client.post(url, payload, format="json")
+
+		assert response.status_code == 400, \
+				"It complains if a batched request fans out too much."
+
+	def test_compose10(self):
+		from django.core.urlresolvers import reverse
+
+		payload = \
+				{ "user": {"url": "/blog/user/", "query": {"id": 1}}
+				, "article": \
+						{ "url": "/blog/article/"
+						, "query": {"user": "{user.id}"}
+						}
+				}
+		sink = InMemorySink()
+		url = reverse("helper-compose") + "?meta"
+		with patch.object(HelperAPI, "compose_metrics_sink", sink), \
+				patch.object(HelperAPI, "compose_measure_size", True):
+			response = self.client.post(url, payload, format="json")
+
+		assert response["Server-Timing"].startswith("user;dur="), \
+				"It reports timings of sub-requests in 'Server-Timing' header."
+		meta = response.json()["_meta"]
+		assert list(meta) == ["user", "article"]
+		assert meta["article"]["db_queries"] == 0 and meta["article"]["size"] > 0, \
+				"It reports queries and sizes of sub-requests if asked."
+		names = set(metric[1] for metric in sink.metrics)
+		assert {"compose.time", "compose.db_queries", "compose.size"} <= names, \
+				"It flushes metrics to the sink."
+
+		payload["_meta"] = {"url": "/blog/user/"}
+		with patch.object(HelperAPI, "compose_instrument", True):
+			response = self.client.post(url, payload, format="json")
+		assert response.status_code == 400, \
+				"It rejects '_meta' key when measurements are asked for."
+
+	def test_compose11(self):
+		from django.core.urlresolvers import reverse
+		from rest_framework import routers
+
+		router = routers.SimpleRouter()
+		router.register("article", ArticleAPI, base_name="article")
+		from tests.urls import urlpatterns
+		urlpatterns.extend(router.urls)
+
+		user = User.objects.create(username="ram")
+		Article.objects.create(title="article1", body="body1", user=user)
+		self.client.force_authenticate(user)
+
+		payload = \
+				{ "user": {"url": "/blog/user/", "query": {"id": 1}}
+				, "article": {"url": "/article/", "query": {"fields": "id,title"}}
+				}
+		response = self.client.post(reverse("helper-compose"), payload, format="json")
+
+		assert response.status_code == 200
+		assert [article["title"] for article in response.json()["article"]] == ["article1"], \
+				"It composes apis which read rows of the request's transaction."
+
+	@patch.object(HelperAPI, "compose_instrument", True)
+	def test_compose12(self):
+		from django.core.urlresolvers import reverse
+		from rest_framework import routers
+
+		router = routers.SimpleRouter()
+		router.register("article", ArticleAPI, base_name="article")
+		from tests.urls import urlpatterns
+		urlpatterns.extend(router.urls)
+
+		user = User.objects.create(username="ram")
+		Article.objects.create(title="article1", body="body1", user=user)
+		self.client.force_authenticate(user)
+
+		payload = \
+				{ "user": {"url": "/blog/user/", "query": {"id": 1}}
+				, "article": {"url": "/article/", "query": {"fields": "id,title"}}
+				}
+		url = reverse("helper-compose") + "?meta"
+		response = self.client.post(url, payload, format="json")
+
+		meta = response.json()["_meta"]
+		assert meta["user"]["db_queries"] == 0 and meta["article"]["db_queries"] == 1, \
+				"It counts queries of sub-requests which read the database."
+		assert meta["article"]["size"] is None, "It does not measure size unless asked."
+
+	@patch.object(HelperAPI, "compose_async", True)
+	def test_compose13(self):
+		from django.core.urlresolvers import reverse
+		from rest_framework import routers
+
+		router = routers.SimpleRouter()
+		router.register("article", ArticleAPI, base_name="article")
+		from tests.urls import urlpatterns
+		urlpatterns.extend(router.urls)
+
+		user = User.objects.create(username="ram")
+		Article.objects.create(title="article1", body="body1", user=user)
+		self.client.force_authenticate(user)
+
+		payload = {"article": {"url": "/article/", "query": {"fields": "id,title"}}}
+		response = self.client.post(reverse("helper-compose"), payload, format="json")
+
+		assert [article["title"] for article in response.json()["article"]] == ["article1"], \
+				"It composes asynchronously in the request's transaction with a single worker."
@@ -0,0 +1,196 @@
+import time
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.urls import clear_url_caches
+from django.contrib.auth.models import User
+from rest_framework import routers
+from rest_framework.decorators import list_route
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from sane_api.apis import SaneAPI, SaneModelAPI
+from sane_api.caches import LocMemComposeCache, DjangoComposeCache
+from sane_api.dispatchers import InProcessDispatcher
+from tests.models import Article, CModel, Comment
+from tests.apis import NestedArticleSerializer
+
+factory = APIRequestFactory()
+
+class CModelAPI(SaneModelAPI):
+	queryset = CModel.objects.all()
+	calls = []
+
+	def get_queryset(self):
+		return self.queryset.all()
+
+	@list_route(methods=["get"])
+	def names(self, request):
+		self.calls.append("names")
+		names = [obj.name for obj in self.get_queryset()]
+		return Response(names, status=200)
+
+	@list_route(methods=["get"])
+	def volatile(self, request):
+		self.calls.append("volatile")
+		return Response([], status=200, headers={"Cache-Control": "no-store"})
+
+	@list_route(methods=["get"])
+	def tagged(self, request):
+		self.calls.append("tagged")
+		if request.META.get("HTTP_IF_NONE_MATCH") == '"v1"':
+			return Response(status=304)
+		headers = {"Cache-Control": "no-cache", "ETag": '"v1"'}
+		return Response(["tagged"], status=200, headers=headers)
+
+	def can_names(self, user, request):
+		return True
+
+	def can_volatile(self, user, request):
+		return True
+
+	def can_tagged(self, user, request):
+		return True
+
+class ArticleAPI(SaneModelAPI):
+	serializer_class = NestedArticleSerializer
+	calls = []
+
+	def get_queryset(self):
+		return Article.objects.all()
+
+	@list_route(methods=["get"])
+	def counts(self, request):
+		self.calls.append("counts")
+		counts = [[obj.title, obj.comments.count()] for obj in self.get_queryset()]
+		return Response(counts, status=200)
+
+	def can_counts(self, user, request):
+		return True
+
+class PlainAPI(SaneAPI):
+	calls = []
+
+	@list_route(methods=["get"])
+	def names(self, request):
+		self.calls.append("names")
+		return Response([], status=200)
+
+	def can_names(self, user, request):
+		return True
+
+def make_request(pk=1):
+	request = factory.post("/helper/compose/", {}, format="json")
+	user = User(username="ram")
+	user.pk = pk
+	force_authenticate(request, user)
+	return Request(request)
+
+class TestLocMemComposeCache(TestCase):
+	def test1(self):
+		cache = LocMemComposeCache(maxsize=2)
+		cache.set("a", 1, None)
+		cache.set("b", 2, None)
+		cache.get("a")
+		cache.set("c", 3, None)
+		assert [cache.get("a"), cache.get("b"), cache.get("c")] == [1, None, 3], \
+				"It evicts least recently used entries."
+
+	def test2(self):
+		cache = LocMemComposeCache()
+		cache.set("a", 1, 0.05)
+		assert cache.get("a") == 1
+		time.sleep(0.1)
+		assert cache.get("a") == None, "It expires entries."
+
+	def test3(self):
+		cache = LocMemComposeCache()
+		cache.bump_version("tests.cmodel")
+		assert cache.get_version("tests.cmodel") == 1, "It bumps versions."
+
+class TestDjangoComposeCache(TestCase):
+	def test1(self):
+		cache = DjangoComposeCache()
+		cache.set("a", {"data": 1}, 10)
+		assert cache.get("a") == {"data": 1}, "It caches through Django's cache."
+		version = cache.get_version("tests.cmodel")
+		cache.bump_version("tests.cmodel")
+		assert cache.get_version("tests.cmodel") == version + 1, "It bumps versions."
+
+class TestCachedDispatcher(TestCase):
+	def setUp(self):
+		from tests.urls import urlpatterns
+
+		CModelAPI.calls = []
+		ArticleAPI.calls = []
+		PlainAPI.calls = []
+		router = routers.SimpleRouter()
+		router.register("cmodel", CModelAPI, base_name="cmodel")
+		router.register("article", ArticleAPI, base_name="article")
+		router.register("plain", PlainAPI, base_name="plain")
+		urlpatterns.extend(router.urls)
+
+	def tearDown(self):
+		from tests.urls import urlpatterns
+		del urlpatterns[:]
+		clear_url_caches()
+
+	def test1(self):
+		cache = LocMemComposeCache()
+		CModel.objects.create(name="one")
+		data = InProcessDispatcher(make_request(), cache=cache).get("/cmodel/names/", {})
+		assert data == ["one"]
+		data = InProcessDispatcher(make_request(), cache=cache).get("/cmodel/names/", {})
+		assert data == ["one"] and CModelAPI.calls == ["names"], \
+				"It returns cached responses across composite requests."
+
+		InProcessDispatcher(make_request(pk=2), cache=cache).get("/cmodel/names/", {})
+		assert len(CModelAPI.calls) == 2, "It scopes cached responses by user."
+
+		CModel.objects.create(name="two")
+		data = InProcessDispatcher(make_request(), cache=cache).get("/cmodel/names/", {})
+		assert data == ["one", "two"], \
+				"It invalidates cached responses when instances of the model change."
+
+	def test2(self):
+		cache = LocMemComposeCache()
+		InProcessDispatcher(make_request(), cache=cache).get("/cmodel/volatile/", {})
+		InProcessDispatcher(make_request(), cache=cache).get("/cmodel/volatile/", {})
+		assert CModelAPI.calls == ["volatile", "volatile"], \
+				"It does not cache responses with 'no-store'."
+
+	def test3(self):
+		cache = LocMemComposeCache()
+		InProcessDispatcher(make_request(), cache=cache).get("/cmodel/tagged/", {})
+		data = InProcessDispatcher(make_request(), cache=cache).get("/cmodel/tagged/", {})
+		assert data == ["tagged"] and CModelAPI.calls == ["tagged", "tagged"], \
+				"It revalidates stale responses having ETag."
+
+	def test4(self):
+		cache = LocMemComposeCache()
+		user = User.objects.create(username="ram")
+		article = Article.objects.create(title="article", body="body", user=user)
+		InProcessDispatcher(make_request(), cache=cache).get("/article/counts/", {})
+		data = InProcessDispatcher(make_request(), cache=cache).get("/article/counts/", {})
+		assert data == [["article", 0]] and ArticleAPI.calls == ["counts"], \
+				"It caches responses of views which only define get_queryset()."
+
+		Comment.objects.create(content="comment", article=article, user=user)
+		data = InProcessDispatcher(make_request(), cache=cache).get("/article/counts/", {})
+		assert data == [["article", 1]], \
+				"It invalidates cached responses when models of nested serializers change."
+
+	def test5(self):
+		cache = LocMemComposeCache()
+		InProcessDispatcher(make_request(), cache=cache).get("/plain/names/", {})
+		InProcessDispatcher(make_request(), cache=cache).get("/plain/names/", {})
+		assert PlainAPI.calls == ["names", "names"], \
+				"It does not cache responses of views of unknown models."
+
+	def test6(self):
+		cache = LocMemComposeCache()
+		with patch("sane_api.caches.post_save.connect") as connect:
+			cache.watch(CModel)
+			cache.watch(CModel)
+		assert connect.call_count == 1, "It connects signals once per model."
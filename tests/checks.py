@@ -0,0 +1,40 @@
+from django.test import TestCase
+from django.urls import clear_url_caches
+from rest_framework import routers
+from rest_framework.decorators import list_route
+from rest_framework.response import Response
+
+from sane_api.apis import SaneAPI
+from sane_api.checks import check_authorizers
+
+
+class CheckedAPI(SaneAPI):
+	@list_route(methods=["get"])
+	def allowed(self, request):
+		return Response([])
+
+	def can_allowed(self, user, request):
+		return True
+
+	@list_route(methods=["get"])
+	def forgotten(self, request):
+		return Response([])
+
+class TestCheckAuthorizers(TestCase):
+	def setUp(self):
+		from tests.urls import urlpatterns
+
+		router = routers.SimpleRouter()
+		router.register("checked", CheckedAPI, base_name="checked")
+		urlpatterns.extend(router.urls)
+
+	def tearDown(self):
+		from tests.urls import urlpatterns
+		del urlpatterns[:]
+		clear_url_caches()
+
+	def test1(self):
+		errors = check_authorizers()
+		assert [error.id for error in errors] == ["sane_api.W001"], \
+				"It warns about routed actions without authorizer."
+		assert "can_forgotten" in errors[0].msg and errors[0].obj is CheckedAPI
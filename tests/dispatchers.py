@@ -0,0 +1,207 @@
+import time
+import threading
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.urls import clear_url_caches, get_resolver
+from django.contrib.auth.models import User
+from rest_framework import routers
+from rest_framework.decorators import list_route
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from sane_api.apis import SaneAPI
+from sane_api.exceptions import ExcessiveFanOut, AmbiguousBatch
+from sane_api.dispatchers import \
+		( Dispatcher
+		, InProcessDispatcher
+		, ClientDispatcher
+		, ResolveCache
+		)
+
+factory = APIRequestFactory()
+
+class EchoAPI(SaneAPI):
+	@list_route(methods=["get"])
+	def echo(self, request):
+		data = \
+				{ "user": request.user.username
+				, "query": dict(request.query_params.items())
+				}
+		return Response(data, status=200)
+
+	def can_echo(self, user, request):
+		return True
+
+	@list_route(methods=["get"])
+	def missing(self, request):
+		return Response({"detail": "Not found."}, status=404)
+
+	def can_missing(self, user, request):
+		return True
+
+def make_request():
+	request = factory.post("/helper/compose/", {}, format="json")
+	force_authenticate(request, User(username="ram"))
+	return Request(request)
+
+class TestInProcessDispatcher(TestCase):
+	def setUp(self):
+		from tests.urls import urlpatterns
+
+		router = routers.SimpleRouter()
+		router.register("dispatch", EchoAPI, base_name="dispatch")
+		urlpatterns.extend(router.urls)
+
+	def tearDown(self):
+		from tests.urls import urlpatterns
+		del urlpatterns[:]
+		clear_url_caches()
+
+	def test1(self):
+		dispatcher = InProcessDispatcher(make_request())
+		with patch.object(JSONRenderer, "render") as render:
+			data = dispatcher.get("http://testserver/dispatch/echo/?a=1", {"b": [2, 3]})
+		assert data == {"user": "ram", "query": {"a": "1", "b": "3"}}, \
+				"It calls the view on behalf of the user with merged query."
+		assert not render.called, "It does not render the response."
+
+	def test2(self):
+		dispatcher = InProcessDispatcher(make_request())
+		assert dispatcher.get("/dispatch/missing/", {}) == None, \
+				"It returns None if the response is not successful."
+		assert dispatcher.get("/nowhere/", {}) == None, \
+				"It returns None if the url is not resolvable."
+
+	def test3(self):
+		request = make_request()
+		data = InProcessDispatcher(request).get("/dispatch/echo/", {"a": 1})
+		assert data == ClientDispatcher(request).get("/dispatch/echo/", {"a": 1}), \
+				"It returns same data as the client dispatcher."
+
+class TestResolveCache(TestCase):
+	def setUp(self):
+		from tests.urls import urlpatterns
+
+		router = routers.SimpleRouter()
+		router.register("dispatch", EchoAPI, base_name="dispatch")
+		urlpatterns.extend(router.urls)
+
+	def tearDown(self):
+		from tests.urls import urlpatterns
+		del urlpatterns[:]
+		clear_url_caches()
+
+	def test1(self):
+		cache = ResolveCache()
+		match = cache.resolve("/dispatch/echo/")
+		with patch.object(type(get_resolver()), "resolve") as resolve:
+			assert cache.resolve("/dispatch/echo/") is match, \
+					"It returns the cached resolution."
+			assert not resolve.called, "It does not resolve a cached url again."
+		assert match.func.actions == {"get": "echo"}, \
+				"It keeps actions of the view."
+
+	def test2(self):
+		cache = ResolveCache(maxsize=1)
+		cache.resolve("/dispatch/echo/")
+		cache.resolve("/dispatch/missing/")
+		assert list(key[1] for key in cache.matches) == ["/dispatch/missing/"], \
+				"It evicts least recently used resolutions."
+
+	def test3(self):
+		cache = ResolveCache()
+		match = cache.resolve("/dispatch/echo/")
+		clear_url_caches()
+		assert cache.resolve("/dispatch/echo/") is not match, \
+				"It drops resolutions when url resolver is rebuilt."
+
+class CountingDispatcher(Dispatcher):
+	calls = []
+
+	def fetch(self, url, query):
+		time.sleep(0.1)
+		self.calls.append(url)
+		return {"url": url}
+
+class TestDispatcher(TestCase):
+	def setUp(self):
+		CountingDispatcher.calls = []
+
+	def test1(self):
+		dispatcher = CountingDispatcher(make_request())
+		first = dispatcher.get("/user/?a=1", {"b": 2, "c": "3"})
+		second = dispatcher.get("/user/", {"c": 3, "a": "1", "b": "2"})
+		assert first is second, "It shares results of identical sub-requests."
+		assert CountingDispatcher.calls == ["/user/?a=1"], \
+				"It makes identical sub-requests once."
+
+		dispatcher.get("/user/", {"a": 2})
+		assert len(CountingDispatcher.calls) == 2, \
+				"It makes different sub-requests."
+
+	def test2(self):
+		request = make_request()
+		request.user.pk = 1
+		results = []
+		def compose():
+			dispatcher = CountingDispatcher(request, coalesce=True)
+			results.append(dispatcher.get("/user/", {}))
+
+		threads = [threading.Thread(target=compose) for i in range(3)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		assert len(CountingDispatcher.calls) == 1, \
+				"It coalesces identical sub-requests of concurrent composite requests."
+
+		CountingDispatcher(request, coalesce=True).get("/user/", {})
+		assert len(CountingDispatcher.calls) == 2, \
+				"It does not keep results of coalesced sub-requests."
+
+class BatchDispatcher(Dispatcher):
+	def fetch(self, url, query):
+		ids = query["id"].split(",")
+		if url == "/paginated/":
+			return {"count": len(ids), "next": "/paginated/?page=2", "results": ids}
+		return ids
+
+class TestDispatcherBatch(TestCase):
+	def test1(self):
+		dispatcher = BatchDispatcher(make_request(), batch_size=2)
+		data = dispatcher.get_batched("/user/", {"id": [1, 2, 3, 2, 4, 5]})
+		assert data == ["1", "2", "3", "4", "5"], \
+				"It merges lists of batched sub-requests."
+		assert len(dispatcher.memo.futures) == 3, \
+				"It makes a sub-request per chunk of unique values."
+
+	def test2(self):
+		dispatcher = BatchDispatcher(make_request(), batch_size=2)
+		data = dispatcher.get_batched("/paginated/", {"id": [1, 2, 3]})
+		assert data == {"count": 3, "next": None, "results": ["1", "2", "3"]}, \
+				"It merges paginated results of batched sub-requests."
+
+	def test3(self):
+		dispatcher = BatchDispatcher(make_request(), batch_size=2, max_fanout=2)
+		try:
+			dispatcher.get_batched("/user/", {"id": [1, 2, 3, 4, 5]})
+			assert 0, "It should have thrown ExcessiveFanOut."
+		except ExcessiveFanOut:
+			pass
+
+		try:
+			dispatcher.get_batched("/user/", {"id": [1], "name": ["a"]})
+			assert 0, "It should have thrown AmbiguousBatch."
+		except AmbiguousBatch:
+			pass
+
+	def test4(self):
+		dispatcher = BatchDispatcher(make_request(), batch_size=2)
+		data = dispatcher.get_batched("/user/", {"id": [1, 2, 3]}, batch_size=1)
+		assert len(dispatcher.memo.futures) == 3, \
+				"It lets batched sub-requests use smaller chunks."
+		assert dispatcher.get_batched("/user/", {"id": []}) == [], \
+				"It returns empty list for nothing to batch."
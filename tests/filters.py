@@ -0,0 +1,41 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from sane_api.filters import SaneFilterSet
+from tests.models import Article
+
+
+class ArticleFilterSet(SaneFilterSet):
+	def get_filterables(self):
+		if self.request == "staff":
+			return {"title": ["exact", "istartswith"], "body": ["icontains"]}
+		return {"title": ["exact"]}
+
+	class Meta:
+		model = Article
+		fields = ["id"]
+
+class TestSaneFilterSet(TestCase):
+	def test1(self):
+		filterset = ArticleFilterSet({"title": "a"}, request="staff")
+		assert list(filterset.filters) == ["title", "title__istartswith", "body__icontains"], \
+				"It generates filters of the filterables."
+		assert list(ArticleFilterSet({}).filters) == ["title"], \
+				"It generates filters by filterables of every instance."
+		assert ArticleFilterSet._meta.fields == ["id"], \
+				"It does not change fields of the filter set."
+
+	def test2(self):
+		first = ArticleFilterSet({})
+		second = ArticleFilterSet({})
+		assert first.base_filters is second.base_filters, \
+				"It reuses filters generated for same filterables."
+		assert first.filters["title"] is not second.filters["title"], \
+				"It does not share filters between instances."
+
+	def test3(self):
+		user = User.objects.create(username="ram")
+		Article.objects.create(title="abc", body="body", user=user)
+		filterset = ArticleFilterSet({"title__istartswith": "AB"}, request="staff")
+		assert filterset.qs.count() == 1, "It filters by generated filters."
+
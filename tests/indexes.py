@@ -0,0 +1,92 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import clear_url_caches
+from rest_framework import routers
+
+from sane_api.apis import SaneModelAPI
+from sane_api.filters import SaneFilterSet
+from sane_api.indexes import get_filtered_views, get_index_suggestions
+from sane_api.management.commands.sane_index_advisor import Command
+from tests.models import Article
+
+
+class ArticleFilterSet(SaneFilterSet):
+	def get_filterables(self):
+		return \
+				{ "id": ["exact", "in"]
+				, "title": ["exact", "istartswith"]
+				, "user": ["exact"]
+				, "user__username": ["icontains"]
+				}
+
+	class Meta:
+		model = Article
+		fields = "__all__"
+
+class FilteredArticleAPI(SaneModelAPI):
+	queryset = Article.objects.all()
+	filter_class = ArticleFilterSet
+
+	def get_queryset(self):
+		return self.queryset.all()
+
+class UsernameFilterSet(SaneFilterSet):
+	def get_filterables(self):
+		return {"user__username": ["startswith"], "title": ["startswith"]}
+
+	class Meta:
+		model = Article
+		fields = "__all__"
+
+class UsernameArticleAPI(FilteredArticleAPI):
+	filter_class = UsernameFilterSet
+
+class TestIndexAdvisor(TestCase):
+	def setUp(self):
+		from tests.urls import urlpatterns
+
+		router = routers.SimpleRouter()
+		router.register("article", FilteredArticleAPI, base_name="article")
+		urlpatterns.extend(router.urls)
+
+	def tearDown(self):
+		from tests.urls import urlpatterns
+		del urlpatterns[:]
+		clear_url_caches()
+
+	def test1(self):
+		views = get_filtered_views()
+		assert views == [FilteredArticleAPI], "It finds routed apis with filter class."
+
+		suggestions = get_index_suggestions(views)
+		got = [(s.model.__name__, s.field.name, s.kind) for s in suggestions]
+		assert got == \
+				[ ("Article", "title", "btree")
+				, ("Article", "title", "upper_pattern")
+				, ("User", "username", "upper_trigram")
+				], "It suggests indexes for unindexed filterables only."
+		assert suggestions[1].lookups == {"istartswith": ["FilteredArticleAPI"]}
+
+		names = [suggestion.name for suggestion in suggestions]
+		left = get_index_suggestions(views, names[:1])
+		assert [suggestion.name for suggestion in left] == names[1:], \
+				"It leaves out existing indexes."
+		assert all(len(name) <= 30 for name in names)
+
+	def test2(self):
+		out = StringIO()
+		call_command(Command(), "--migration", stdout=out)
+		output = out.getvalue()
+		assert "models.Index(fields=['title']" in output, \
+				"It suggests indexes as migration operations."
+		assert 'UPPER("title") varchar_pattern_ops' in output, \
+				"It suggests functional indexes as SQL."
+		assert "class Migration" in output, "It writes migrations if asked."
+
+	def test3(self):
+		suggestions = get_index_suggestions([UsernameArticleAPI])
+		got = [(s.model.__name__, s.field.name, s.kind) for s in suggestions]
+		assert got == [("Article", "title", "pattern")], \
+				"It leaves out pattern indexes which Django creates for indexed fields."
@@ -0,0 +1,33 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from sane_api.metrics import ComposeMeter, InMemorySink
+
+
+class TestComposeMeter(TestCase):
+	def test1(self):
+		meter = ComposeMeter(measure_size=True)
+		def fetch():
+			meter.record_cache(True)
+			return list(User.objects.all())
+
+		assert meter.measure("user", None, fetch) == []
+		record = meter.records["user"]
+		assert record["db_queries"] == 1, "It counts database queries."
+		assert record["cache"] == "hit", "It records cache usage."
+		assert record["size"] == 2, "It records size of the rendered response."
+
+	def test2(self):
+		meter = ComposeMeter()
+		meter.measure("user.list", None, lambda: None)
+		assert meter.server_timing().startswith("user_list;dur="), \
+				"It names timings with valid tokens."
+
+		assert meter.records["user.list"]["size"] is None, \
+				"It does not measure size unless asked."
+
+		sink = InMemorySink()
+		meter.flush(sink)
+		names = [metric[1] for metric in sink.metrics]
+		assert "compose.time" in names and "compose.size" not in names, \
+				"It flushes records to the sink."
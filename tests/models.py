@@ -0,0 +1,33 @@
+from django.db import models
+from django.contrib.auth.models import User
+
+
+class CModel(models.Model):
+	name = models.CharField(max_length=20)
+
+
+class Article(models.Model):
+	title = models.CharField(max_length=100)
+	body = models.TextField()
+	user = models.ForeignKey(User, related_name="posts", on_delete=models.CASCADE)
+	created_on = models.DateTimeField(auto_now_add=True)
+
+
+class Attachment(models.Model):
+	name = models.CharField(max_length=100)
+	file = models.FileField()
+
+
+class Comment(models.Model):
+	content = models.CharField(max_length=200)
+	article = models.ForeignKey(Article, related_name="comments", on_delete=models.CASCADE)
+	user = models.ForeignKey(User, related_name="comments", on_delete=models.CASCADE)
+
+	def can_retrieve(self, user, request):
+		return True
+
+	@classmethod
+	def permission_q(cls, action, user):
+		if action == "list":
+			return models.Q(user=user)
+		return None
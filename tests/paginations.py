@@ -0,0 +1,142 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from sane_api.apis import SaneModelAPI
+from sane_api.paginations import SaneKeysetPagination
+from tests.models import Article, Comment
+from tests.apis import ArticleSerializer, CommentSerializer
+
+factory = APIRequestFactory()
+
+class CommentAPI(SaneModelAPI):
+	queryset = Comment.objects.all()
+	serializer_class = CommentSerializer
+	pagination_class = SaneKeysetPagination
+
+	def get_queryset(self):
+		return self.queryset.all()
+
+	def can_list(self, user, request):
+		return True
+
+class ArticleAPI(SaneModelAPI):
+	queryset = Article.objects.all()
+	serializer_class = ArticleSerializer
+	pagination_class = SaneKeysetPagination
+	keyset_ordering = ["-created_on"]
+
+	def get_queryset(self):
+		return self.queryset.all()
+
+	def can_list(self, user, request):
+		return True
+
+class TestSaneKeysetPagination(TestCase):
+	def setUp(self):
+		self.ram = User.objects.create(username="ram")
+		hari = User.objects.create(username="hari")
+		article = Article.objects.create(title="article", body="body", user=self.ram)
+		for i in range(7):
+			user = self.ram if i % 2 else hari
+			Comment.objects.create(content="comment{}".format(i), article=article, user=user)
+
+	def list(self, query):
+		request = factory.get("/comment/", query)
+		request.user = self.ram
+		aview = CommentAPI.as_view(actions= {'get': 'list', })
+		return aview(request).data
+
+	def test1(self):
+		contents = []
+		query = {"page_size": 2}
+		while True:
+			data = self.list(query)
+			contents.extend(comment["content"] for comment in data["results"])
+			if data["next_cursor"] is None:
+				break
+			query["cursor"] = data["next_cursor"]
+		assert contents == ["comment5", "comment3", "comment1"], \
+				"It pages through authorized rows by pk, newest first."
+		assert "count" not in data, "It does not count by default."
+
+	def test2(self):
+		data = self.list({"page_size": 2})
+		assert data["next"].startswith("http://testserver/comment/?") \
+				and "cursor=" in data["next"], "It links to the next page."
+
+	def test3(self):
+		paginator = SaneKeysetPagination()
+		paginator.count_mode = "estimate"
+		request = Request(factory.get("/", {"page_size": 3}))
+		queryset = Comment.objects.filter(user=self.ram)
+		page = paginator.paginate_queryset(queryset, request)
+		assert paginator.count == 3 and len(page) == 3, \
+				"It counts rows of filtered queryset."
+		assert paginator.next_cursor is None
+
+	def test4(self):
+		paginator = SaneKeysetPagination()
+		request = Request(factory.get("/"))
+		ordering = paginator.get_ordering(Comment.objects.all(), None)
+		assert ordering == ["-pk"]
+
+		class View:
+			keyset_ordering = ["user", "-id"]
+		assert paginator.get_ordering(Comment.objects.all(), View()) == ["user", "-id"], \
+				"It takes ordering of the view."
+
+		paginator.ordering = ["user", "-pk"]
+		q = paginator.get_keyset_q([1, 5])
+		comments = Comment.objects.order_by("user", "-pk").filter(q)
+		assert all((c.user_id, -c.pk) > (1, -5) for c in comments) \
+				and comments.count() == Comment.objects.filter(user_id__gt=1).count() \
+						+ Comment.objects.filter(user_id=1, pk__lt=5).count(), \
+				"It keeps rows after the cursor."
+
+	def test5(self):
+		request = factory.get("/comment/", {"cursor": "garbage"})
+		request.user = self.ram
+		aview = CommentAPI.as_view(actions= {'get': 'list', })
+		assert aview(request).status_code == 404, "It rejects invalid cursors."
+
+	def test6(self):
+		now = timezone.now().replace(microsecond=500) - timedelta(days=1)
+		for i in range(4):
+			article = Article.objects.create(title="article{}".format(i), body="body", user=self.ram)
+			Article.objects.filter(pk=article.pk).update(created_on=now + timedelta(microseconds=i))
+
+		titles = []
+		query = {"page_size": 1}
+		while True:
+			request = factory.get("/article/", query)
+			request.user = self.ram
+			data = ArticleAPI.as_view(actions= {'get': 'list', })(request).data
+			titles.extend(article["title"] for article in data["results"])
+			if data["next_cursor"] is None:
+				break
+			query["cursor"] = data["next_cursor"]
+		assert titles == ["article", "article3", "article2", "article1", "article0"], \
+				"It pages through datetimes which differ in microseconds."
+
+	def test7(self):
+		class View:
+			keyset_ordering = ["-last_login"]
+		with self.assertRaises(ImproperlyConfigured, msg="It rejects nullable ordering fields."):
+			SaneKeysetPagination().get_ordering(User.objects.all(), View())
+
+	def test8(self):
+		class View:
+			keyset_ordering = ["user__username"]
+		with self.assertRaises(ImproperlyConfigured, msg="It rejects fields of related models."):
+			SaneKeysetPagination().get_ordering(Comment.objects.all(), View())
+
+		with patch.object(Comment._meta, "ordering", ["user__username", "content"]):
+			ordering = SaneKeysetPagination().get_ordering(Comment.objects.all(), None)
+		assert ordering == ["-pk"], "It orders by pk if ordering of the model spans relations."
@@ -9,6 +9,7 @@ from sane_api.serializers import \
 		( SaneSerializer
 		, SaneModelSerializer
 		, SaneSerializerMixin
+		, FieldPlanCache
 		)
 
 factory = APIRequestFactory()
@@ -261,6 +262,112 @@ class TestSaneSerializer(TestCase):
 		assert s.data == expected,\
 				"It handles nested fields request for many to many relation."
 
+class CachedSaneSerializer(ASaneSerializer):
+	calls = []
+
+	def get_readable_fields(self):
+		self.calls.append("get_readable_fields")
+		return ['field1', 'field2', 'field3']
+
+	def get_access_profile_key(self):
+		return "staff"
+
+class TestFieldPlanCache(TestCase):
+	def setUp(self):
+		CachedSaneSerializer.calls = []
+		CachedSaneSerializer.field_plans = FieldPlanCache()
+
+	def test1(self):
+		request = factory.get("/", content_type='application/json')
+		request.query_params = {"fields": "field1,field3"}
+		first = CachedSaneSerializer(AnObject, context = {"request": request})
+		second = CachedSaneSerializer(AnObject, context = {"request": request})
+		assert first.data == second.data == {"field1": 1, "field3": 3}, \
+			"It returns requested readable fields."
+		assert CachedSaneSerializer.calls == ["get_readable_fields"], \
+			"It computes fields once per access profile and requested fields."
+		assert first.fields["field1"] is not second.fields["field1"], \
+			"It does not share fields between serializers."
+
+	def test2(self):
+		request = factory.get("/", content_type='application/json')
+		request.query_params = {}
+		CachedSaneSerializer(AnObject, context = {"request": request})
+		request.query_params = {"fields": "field2"}
+		s = CachedSaneSerializer(AnObject, context = {"request": request})
+		assert s.data == {"field2": 2}, "It caches fields by requested fields."
+		assert len(CachedSaneSerializer.calls) == 2
+
+	def test3(self):
+		cache = FieldPlanCache(maxsize=1)
+		cache.set("a", ((), ()))
+		cache.set("b", ((), ()))
+		assert cache.get("a") == None and cache.get("b") == ((), ()), \
+			"It evicts least recently used plans."
+
+class TestSaneSerializerRepresentation(TestCase):
+	def setUp(self):
+		CachedSaneSerializer.calls = []
+
+	def test1(self):
+		request = factory.get("/", content_type='application/json')
+		request.query_params = {"fields": "field1,field4,field6"}
+		s = CachedSaneSerializer \
+				([AnObject(), AnObject(), AnObject()], many=True, context = {"request": request})
+		assert s.data == [{"field1": 1, "field4": None, "field6": None}] * 3, \
+			"It assigns 'None' to inaccessible or unavailable fields."
+		assert len(CachedSaneSerializer.calls) <= 1, \
+			"It computes accessible fields once for a list."
+
+class PModel(models.Model):
+	field1 = models.IntegerField()
+	calls = []
+
+	class Meta:
+		app_label = "tests"
+
+	@classmethod
+	def can_many(cls, objs, user, request):
+		cls.calls.append("can_many")
+		return dict((obj.pk, ["retrieve"] if obj.pk % 2 else []) for obj in objs)
+
+	def can_retrieve(self, user, request):
+		self.calls.append("can_retrieve")
+		return True
+
+	def can_destroy(self, user, request):
+		self.calls.append("can_destroy")
+		return False
+
+class PSaneSerializer(SaneModelSerializer):
+	def get_readable_fields(self):
+		return ['field1', 'permissions']
+
+	class Meta:
+		model = PModel
+		fields = "__all__"
+
+class TestPermissionField(TestCase):
+	def setUp(self):
+		PModel.calls = []
+		self.request = factory.get("/", content_type='application/json')
+		self.request.query_params = {}
+		self.request.user = {}
+
+	def test1(self):
+		s = PSaneSerializer(PModel(pk=1, field1=1), context = {"request": self.request})
+		assert s.data["permissions"] == ["retrieve"], \
+			"It authorizes a single object by its authorizers."
+		assert "can_many" not in PModel.calls
+
+	def test2(self):
+		objs = [PModel(pk=pk, field1=pk) for pk in range(1, 5)]
+		s = PSaneSerializer(objs, many=True, context = {"request": self.request})
+		permissions = [data["permissions"] for data in s.data]
+		assert permissions == [["retrieve"], [], ["retrieve"], []], \
+			"It authorizes objects of a list by 'can_many'."
+		assert PModel.calls == ["can_many"], "It authorizes a list at once."
+
 class TestSaneSerializerTester:
 	def test1(self):
 		assert 0, "It warns about serializers which do not implement SaneSeriaizer"
@@ -1,12 +1,25 @@
+import time
+import threading
+
 from django.test import TestCase
 
 from sane_api.helpers import \
 		( get_cyclic_dependency
+		, get_cyclic_dependencies
 		, get_unmet_dependency
+		, get_unmet_dependencies
 		, get_value_at
 		, fill_template
+		, compile_template
+		, get_dependency_levels
+		, iter_requests
+		, make_requests
+		, make_requests_async
+		, run_until_complete
+		, get_compose_executor
+		, is_batched
 		)
-from sane_api.exceptions import UnmetDependency
+from sane_api.exceptions import UnmetDependency, CyclicDependency
 
 
 class TestHasCyclicDependency(TestCase):
@@ -28,6 +41,26 @@ class TestHasCyclicDependency(TestCase):
 		assert get_cyclic_dependency(data) == None, \
 				"Returns None if has no cyclic dependency."
 
+	def test3(self):
+		data = \
+				{ "article": {"query": {"user": "{user.id}"}}
+				, "user": {"query": {"article": "{article.id}"}}
+				, "comment": {"query": {"comment": "{comment.id}"}}
+				, "tag": {"query": {"article": "{article.id}"}}
+				, "like": {"query": {"user": "{nokey.id}"}}
+				}
+		assert get_cyclic_dependencies(data) == ["article", "user", "comment"], \
+				"Returns every key which is a part of cyclic dependency."
+
+	def test4(self):
+		data = dict \
+				( ("key{}".format(i), {"query": {"parent": "{{key{}.id}}".format(i - 1)}})
+				for i in range(1, 5000)
+				)
+		data["key0"] = {"query": {}}
+		assert get_cyclic_dependencies(data) == [], \
+				"It handles deep dependency chains."
+
 
 class TestHasUnmetDependency(TestCase):
 	def test1(self):
@@ -46,6 +79,14 @@ class TestHasUnmetDependency(TestCase):
 		assert get_unmet_dependency(data) == None, \
 				"Returns None if has no unmet dependency."
 
+	def test3(self):
+		data = \
+				{ "user": {"query": {"group": "{group.id}"}}
+				, "article": {"query": {"comment": "{comment.id}", "user": "{user.id}"}}
+				}
+		assert get_unmet_dependencies(data) == [["user", "group"], ["article", "comment"]], \
+				"Returns every key which has unmet dependency."
+
 class TestGetValueAt(TestCase):
 	def test1(self):
 		path = ["user", "id"]
@@ -75,6 +116,31 @@ class TestGetValueAt(TestCase):
 		except UnmetDependency:
 			pass
 
+	def test4(self):
+		path = ["user", "id"]
+		source = { "user": [{"id": 1}, [{"id": 2}, {"id": 1}]]}
+		assert get_value_at(path, source, start=True, collection=list) == [1, 2, 1], \
+				"It collects values into the given collection."
+		assert get_value_at(path, source, start=True, collection=set) == {1, 2}, \
+				"It collects values into the given collection."
+		assert get_value_at(path, {"user": []}, start=True) == "", \
+				"It returns empty string for empty list."
+
+	def test5(self):
+		path = ["user", "id"]
+		source = { "user": {"id": 1}}
+		get_value_at(path, source, start=True)
+		assert path == ["user", "id"], "It does not mutate the path."
+
+	def test6(self):
+		path = ["x", "id"]
+		source = { "user": {"id": 1}}
+		try:
+			get_value_at(path, source, start=True)
+			assert 0, "It should have thrown KeyError."
+		except KeyError:
+			pass
+
 class TestFillTemplate(TestCase):
 	def test1(self):
 		req_sig = \
@@ -101,3 +167,245 @@ class TestFillTemplate(TestCase):
 				}
 		assert fill_template(req_sig, source) == None, \
 				"It returns None template could not be filled due to unresolved dependency."
+
+	def test3(self):
+		req_sig = \
+				{ "url": "/api/comment/"
+				, "query": {"title": "{article.title}", "ids": ["{user.id}", "x-{article.id}"]}
+				}
+		source = { "user": [{"id": 1}, {"id": 2}], "article": {"id": 1, "title": "say \"hi\""}}
+		expected = \
+				{ "url": "/api/comment/"
+				, "query": {"title": "say \"hi\"", "ids": ["1,2", "x-1"]}
+				}
+		assert fill_template(req_sig, source) == expected, \
+				"It fills values which contain quotes and placeholders within strings."
+		assert req_sig["query"]["ids"] == ["{user.id}", "x-{article.id}"], \
+				"It does not mutate the template."
+
+	def test4(self):
+		req_sig = \
+				{ "url": "/api/comment/"
+				, "query": {"user": "{user.id}", "title": "x-{user.id}"}
+				}
+		source = { "user": [{"id": 1}, {"id": 2}]}
+		expected = \
+				{ "url": "/api/comment/"
+				, "query": {"user": [1, 2], "title": "x-1,2"}
+				}
+		assert compile_template(req_sig).fill(source, collection=list) == expected, \
+				"It fills whole value placeholders with collection of values."
+
+	def test5(self):
+		req_sig = \
+				{ "url": "/api/comment/"
+				, "query": {"user": "{user.id}", "org": "{org.id}"}
+				}
+		source = { "user": [{"id": 1}, {"id": 2}], "org": {"id": 7}}
+		expected = \
+				{ "url": "/api/comment/"
+				, "query": {"user": [1, 2], "org": 7}
+				}
+		assert compile_template(req_sig).fill(source, collection=list) == expected, \
+				"It fills placeholders which do not go through lists with values."
+
+class TestIsBatched(TestCase):
+	def test1(self):
+		assert is_batched({"url": "/", "batch": True}) and is_batched({"url": "/", "batch": "true"})
+		assert not is_batched({"url": "/", "batch": "false"}), \
+				"It reads 'batch' the way the request serializer does."
+		assert not is_batched({"url": "/", "batch": "maybe"}) and not is_batched({"url": "/"})
+
+class TestCompileTemplate(TestCase):
+	def test1(self):
+		req_sig = \
+				{ "url": "/api/comment/{article.id}/"
+				, "query": {"user": "{user.id}", "user_name": "{a_user.name}"}
+				}
+		template = compile_template(req_sig)
+		assert template.dependencies == {"article", "user", "a_user"}, \
+				"It records dependencies of the template."
+		assert compile_template(template) is template, \
+				"It does not recompile a compiled template."
+
+class TestGetDependencyLevels(TestCase):
+	def test1(self):
+		data = \
+				{ "comment": {"query": {"article": "{article.id}", "user": "{user.id}"}}
+				, "article": {"query": {"user": "{user.id}"}}
+				, "user": {"query": {}}
+				, "tag": {"query": {}}
+				}
+		assert get_dependency_levels(data) == [["user", "tag"], ["article"], ["comment"]], \
+				"It groups keys into levels of independent keys."
+
+class FakeDispatcher:
+	def __init__(self, delay=0, delays=None, barrier=None, gate=None, gated=None):
+		self.delay = delay
+		self.delays = delays or {}
+		# requests of 'gated' urls, or of every url if it is None, wait for
+		# each other at the barrier, so they break it unless they are made
+		# concurrently, and wait for the gate to open
+		self.barrier = barrier
+		self.gate = gate
+		self.gated = gated
+		self.started = []
+		self.urls = []
+
+	def get(self, url, query):
+		self.started.append(url)
+		if self.gated is None or url in self.gated:
+			if self.barrier is not None:
+				self.barrier.wait()
+			if self.gate is not None:
+				self.gate.wait(5)
+		time.sleep(self.delays.get(url, self.delay))
+		self.urls.append(url)
+		if url == "/fail/":
+			return None
+		if url == "/error/":
+			raise RuntimeError(url)
+		return {"id": len(url), "query": query}
+
+class TestMakeRequests(TestCase):
+	def test1(self):
+		req_sigs = \
+				[ ["article", {"url": "/article/", "query": {"user": "{user.id}"}}]
+				, ["user", {"url": "/user/"}]
+				]
+		responses = make_requests(FakeDispatcher(), req_sigs)
+		assert responses["article"]["query"] == {"user": "6"}, \
+				"It makes dependencies first and fills the dependents."
+
+	def test2(self):
+		req_sigs = [[str(i), {"url": "/root/"}] for i in range(4)]
+		dispatcher = FakeDispatcher(barrier=threading.Barrier(4, timeout=5))
+		responses = make_requests(dispatcher, req_sigs, max_workers=4)
+		assert len(responses) == 4, "It makes independent requests concurrently."
+
+	def test3(self):
+		req_sigs = \
+				[ ["article", {"url": "/article/", "query": {"user": "{user.id}"}}]
+				, ["user", {"url": "/user/", "query": {"article": "{article.id}"}}]
+				, ["tag", {"url": "/tag/"}]
+				]
+		dispatcher = FakeDispatcher()
+		try:
+			make_requests(dispatcher, req_sigs, max_workers=2)
+			assert 0, "It should have thrown CyclicDependency."
+		except CyclicDependency:
+			pass
+		assert dispatcher.urls == ["/tag/"], "It stops when no progress can be made."
+
+	def test4(self):
+		req_sigs = \
+				[ ["article", {"url": "/article/", "query": {"user": "{user.id}"}}]
+				]
+		try:
+			make_requests(FakeDispatcher(), req_sigs)
+			assert 0, "It should have thrown UnmetDependency."
+		except UnmetDependency:
+			pass
+
+	def test5(self):
+		req_sigs = [["key0", {"url": "/key/"}]]
+		for i in range(1, 3000):
+			req_sigs.append \
+					(["key{}".format(i), {"url": "/key/", "query": {"id": "{{key{}.id}}".format(i - 1)}}])
+		responses = make_requests(FakeDispatcher(), req_sigs)
+		assert len(responses) == 3000, "It handles long dependency chains."
+
+	def test6(self):
+		req_sigs = [[str(i), {"url": "/root/"}] for i in range(6)]
+		make_requests(FakeDispatcher(), req_sigs, max_workers=3)
+		make_requests(FakeDispatcher(), req_sigs, max_workers=3)
+		executor = get_compose_executor(3)
+		assert len(executor.threads) == 3 and all(thread.is_alive() for thread in executor.threads), \
+				"It makes requests on a pool which is shared across calls."
+
+class TestIterRequests(TestCase):
+	def test1(self):
+		req_sigs = \
+				[ ["user", {"url": "/slow/"}]
+				, ["tag", {"url": "/tag/"}]
+				]
+		dispatcher = FakeDispatcher(delays={"/slow/": 0.2})
+		keys = [key for key, response in iter_requests(dispatcher, req_sigs, max_workers=2)]
+		assert keys == ["tag", "user"], "It yields responses as soon as they are done."
+
+class TestMakeRequestsAsync(TestCase):
+	def test1(self):
+		req_sigs = \
+				[ ["article", {"url": "/article/", "query": {"user": "{user.id}"}}]
+				, ["user", {"url": "/user/"}]
+				, ["tag", {"url": "/tag/"}]
+				]
+		dispatcher = FakeDispatcher \
+				(barrier=threading.Barrier(2, timeout=5), gated={"/user/", "/tag/"})
+		responses = run_until_complete(make_requests_async(dispatcher, req_sigs, max_workers=4))
+		assert responses["tag"]["id"] == 5, "It makes independent requests concurrently."
+		assert responses["article"]["query"] == {"user": "6"}, \
+				"It makes dependencies first and fills the dependents."
+
+	def test2(self):
+		req_sigs = \
+				[ ["user", {"url": "/fail/"}]
+				, ["article", {"url": "/article/", "query": {"user": "{user.id}"}}]
+				, ["tag", {"url": "/tag/"}]
+				]
+		dispatcher = FakeDispatcher()
+		responses = run_until_complete(make_requests_async(dispatcher, req_sigs, max_workers=4))
+		assert responses["user"] == None and responses["article"] == None, \
+				"It cancels dependents of a failed request."
+		assert "/article/" not in dispatcher.urls, \
+				"It does not make requests whose dependency has failed."
+		assert responses["tag"]["id"] == 5
+
+	def test3(self):
+		req_sigs = \
+				[ ["user", {"url": "/slow/"}]
+				, ["article", {"url": "/article/", "query": {"user": "{user.id}"}}]
+				, ["tag", {"url": "/tag/"}]
+				]
+		gate = threading.Event()
+		dispatcher = FakeDispatcher(gate=gate, gated={"/slow/"})
+		responses = run_until_complete(make_requests_async \
+				(dispatcher, req_sigs, max_workers=4, request_timeout=0.1))
+		gate.set()
+		assert responses["user"] == None and responses["article"] == None, \
+				"It fails a request and its dependents if the request times out."
+		assert responses["tag"]["id"] == 5
+
+	def test4(self):
+		req_sigs = \
+				[ ["user", {"url": "/slow/"}]
+				, ["tag", {"url": "/tag/"}]
+				]
+		gate = threading.Event()
+		dispatcher = FakeDispatcher(gate=gate, gated={"/slow/"})
+		responses = run_until_complete(make_requests_async \
+				(dispatcher, req_sigs, max_workers=4, timeout=0.1))
+		assert "/slow/" not in dispatcher.urls, "It stops when the deadline is over."
+		gate.set()
+		assert responses == {"user": None, "tag": {"id": 5, "query": {}}}, \
+				"It fails the pending requests when the deadline is over."
+
+	def test5(self):
+		req_sigs = [[str(i), {"url": "/slow/"}] for i in range(4)]
+		gate = threading.Event()
+		dispatcher = FakeDispatcher(gate=gate)
+		responses = run_until_complete(make_requests_async \
+				(dispatcher, req_sigs, max_workers=2, timeout=0.1, request_timeout=0.05))
+		assert list(responses.values()) == [None] * 4
+		gate.set()
+		deadline = time.time() + 5
+		while len(dispatcher.urls) < 2 and time.time() < deadline:
+			time.sleep(0.01)
+		time.sleep(0.05)
+		assert len(dispatcher.started) == 2, \
+				"It leaves at most 'max_workers' requests running after failing them."
+
+	def test6(self):
+		req_sigs = [["user", {"url": "/error/"}], ["tag", {"url": "/tag/"}]]
+		with self.assertRaises(RuntimeError, msg="It raises unexpected errors of requests."):
+			run_until_complete(make_requests_async(FakeDispatcher(), req_sigs, max_workers=2))